@@ -1,22 +1,108 @@
 import click
 import importlib
 import os
-import shutil
 import sys
-import jinja2
-import jinja2td
-import json
+import re
+import hashlib
+import multiprocessing
 from pathlib import Path
-from functools import partial
+from functools import partial, lru_cache
+from dataclasses import dataclass
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 
 from . import log
 from .plugin import PluginScheduler
 from .snapshot import Snapshot, Diff
 from .markdown import Markdown
-from .utils import file_status, file_status_done, cleartree
+from .utils import (
+    file_status,
+    file_status_done,
+    cleartree,
+    copy_file,
+    read_text,
+    write_file,
+    write_text,
+    read_json,
+    write_json,
+    loads_json,
+    dumps_json,
+    rewrite_file,
+)
 from .doctree import DocumentTree
 from .relationships import Relationships
 
+# the page renderer used by the worker processes, inherited from the parent
+# process when the pool is forked
+_render_worker = None
+
+
+def _render_page_worker(task):
+    return _render_worker(*task)
+
+
+def _can_fork():
+    # forking is only safe on Linux: it is unsafe on macOS with the system
+    # frameworks, and unavailable on Windows
+    return (
+        sys.platform.startswith("linux")
+        and "fork" in multiprocessing.get_all_start_methods()
+    )
+
+
+# changed when the format of one of the cache files changes, so that all of them
+# are discarded together, like on a fresh build
+_CACHE_VERSION = "1"
+
+
+# compiled plugin scripts, kept between the builds in watch mode
+_plugin_scripts = {}
+
+
+def _plugin_script_code(spec):
+    # the scripts are executed again on fresh builds to register their
+    # callbacks, but they don't have to be compiled again if they didn't change
+    st = os.stat(spec.origin)
+    cached = _plugin_scripts.get(spec.origin)
+
+    if cached is None or cached[0] != (st.st_size, st.st_mtime_ns):
+        cached = ((st.st_size, st.st_mtime_ns), spec.loader.get_code(spec.name))
+        _plugin_scripts[spec.origin] = cached
+
+    return cached[1]
+
+
+def _file_size(path):
+    try:
+        return os.stat(path).st_size
+    except FileNotFoundError:
+        return None
+
+
+@lru_cache(maxsize=None)
+def _relative_root(depth):
+    return "/".join([".."] * depth) if depth else "."
+
+
+@dataclass(frozen=True)
+class _PageLocation:
+    source: str  # path of the markdown file
+    output: str  # path of the HTML file
+    destination: str  # path of the HTML file in the output directory
+    root: str  # relative path from the page to the output directory
+
+
+# the content of a page is only rendered with Jinja if it could contain code
+_JINJA_SYNTAX_RE = re.compile(r"\{[{%#]")
+
+
+# the markers left in the pages by the functions that need postprocessing
+_MARKER_RE = re.compile(rb"<!--KOMOE:(.*?)-->", re.DOTALL)
+
+# the compact JSON of the docpath markers, when the separator has no escapes
+_DOCPATH_MARKER_RE = re.compile(
+    rb'\{"op":"docpath","sep":"([^"\\]*)","maxdepth":(\d+),"include":(true|false)\}'
+)
+
 
 class Builder:
     def __init__(self, config, base_dir, **options):
@@ -25,6 +111,14 @@ class Builder:
 
         self.__base_dir = base_dir
 
+        # string versions of the directories, used to build the paths of pages
+        # and static files
+        self.__source_root = str(self.source_dir)
+        self.__output_root = str(self.output_dir)
+        self.__static_root = str(self.static_dir)
+        self.__static_output_root = str(self.static_output_dir)
+        self.__markdown_cache_root = str(self.markdown_cache_dir)
+
         self.__snapshots = {
             "source": {"path": self.source_dir},
             "templates": {"path": self.templates_dir},
@@ -33,17 +127,44 @@ class Builder:
         self.__templates = Relationships()
         self.__doctree = DocumentTree()
         self.__postprocess = []
+        self.__markdown_keys = {}
+        self.__markdown_keys_modified = True
+        self.__markdown_orphans = set()
+        self.__output_hashes = {}
+        self.__output_hashes_modified = True
 
         self.__md = Markdown()
 
+        # Jinja is imported here so that commands that don't build anything
+        # don't have to load it
+        import jinja2
+        import jinja2td
+        from .jinja import IntrospectionBytecodeCache
+
+        bytecode_dir = self.cache_dir / "jinja"
+        bytecode_dir.mkdir(parents=True, exist_ok=True)
+
         self.__j2 = jinja2.Environment(
             loader=jinja2.FileSystemLoader(str(self.templates_dir)),
             extensions=[jinja2td.Introspection],
+            bytecode_cache=IntrospectionBytecodeCache(str(bytecode_dir)),
+            # a new builder is created for every build, so the templates can't
+            # change while they are in memory
+            auto_reload=False,
+            cache_size=-1,
         )
 
         self.__postprocessors = {"docpath": self.__document_path_postprocess}
+        self.__docpath_cache = {}
+        self.__template_index = {}
+        self.__created_dirs = set()
+        self.__page_locations = {}
 
         self.__plugin_packages = {}
+        # identifies the plugins, whose changes can change the markdown output
+        self.__plugins_hash = hashlib.blake2b(digest_size=16)
+        self.__old_plugins_hash = None
+        self.__cache_version_matches = False
 
     @property
     def base_dir(self):
@@ -57,6 +178,10 @@ class Builder:
     def output_dir(self):
         return self.__base_dir / self.__config.output_directory
 
+    @property
+    def markdown_cache_dir(self):
+        return self.cache_dir / "md"
+
     @property
     def static_output_dir(self):
         return self.output_dir / "_static"
@@ -82,6 +207,8 @@ class Builder:
         return self.__md
 
     def build(self):
+        self.__created_dirs = set()
+
         if self.__options["fresh"]:
             PluginScheduler.reset()
         else:
@@ -101,13 +228,19 @@ class Builder:
 
         self.__md.init()
 
-        self.__scan_directories()
+        self.__cache_version_matches = self.__check_cache_version()
 
-        if self.__options["fresh"]:
+        if self.__options["fresh"] or not self.__cache_version_matches:
             self.__clear_output_directory()
+            self.__clear_markdown_cache()
         else:
             self.__load_cache_data()
 
+        self.markdown_cache_dir.mkdir(parents=True, exist_ok=True)
+
+        self.__scan_directories()
+        self.__index_templates()
+
         PluginScheduler.build_started()
         click.echo("Build started ...")
 
@@ -133,6 +266,9 @@ class Builder:
     def snapshot_diff(self, name):
         return self.snapshot_current(name).diff(self.snapshot_old(name))
 
+    def snapshot_partition(self, name):
+        return self.snapshot_current(name).partition(self.snapshot_old(name))
+
     def get_package_alias(self, pkg, default=None):
         return self.__plugin_packages.get(pkg, default)
 
@@ -154,6 +290,11 @@ class Builder:
                     log.error(f"can't load plugin “{name}”: {e}")
                     raise click.ClickException("failed to load plugins")
 
+                version = getattr(sys.modules[plugin["package"]], "__version__", None)
+                self.__plugins_hash.update(
+                    repr((name, plugin["package"], version)).encode("utf8")
+                )
+
             elif "script" in plugin:
                 # load module from file path
                 script_path = Path(plugin["script"])
@@ -162,6 +303,14 @@ class Builder:
 
                 script_module = name + "_komoe_plugin"
 
+                try:
+                    with open(script_path, "rb") as f:
+                        self.__plugins_hash.update(repr(name).encode("utf8"))
+                        self.__plugins_hash.update(f.read())
+                except OSError as e:
+                    log.error(f"can't load plugin “{name}”: {e}")
+                    raise click.ClickException("failed to load plugins")
+
                 if PluginScheduler.add_script(script_module):
                     spec = importlib.util.spec_from_file_location(
                         script_module, script_path
@@ -169,7 +318,7 @@ class Builder:
                     module = importlib.util.module_from_spec(spec)
 
                     try:
-                        spec.loader.exec_module(module)
+                        exec(_plugin_script_code(spec), module.__dict__)
                     except Exception as e:
                         log.error(f"can't load plugin “{name}”: {e}")
                         raise click.ClickException("failed to load plugins")
@@ -177,74 +326,167 @@ class Builder:
             else:
                 log.warn(f"plugin “{name}” is declared but has no package/script")
 
+    def __check_cache_version(self):
+        try:
+            version = read_text(self.cache_dir / "version")
+        except FileNotFoundError:
+            version = None
+
+        if version == _CACHE_VERSION:
+            return True
+
+        # the caches written before the version was recorded have snapshots
+        if version is not None or any(self.cache_dir.glob("snapshot_*")):
+            log.info("The cache is from another version, everything is rebuilt")
+        return False
+
     def __load_cache_data(self):
+        # the cached markdown output is discarded when the plugins changed, as
+        # they can change the extensions or their configuration
+        try:
+            self.__old_plugins_hash = read_text(self.cache_dir / "plugins")
+        except FileNotFoundError:
+            pass
+        if self.__old_plugins_hash != self.__plugins_hash.hexdigest():
+            self.__clear_markdown_cache()
+
         # loading previous snapshots
         for name in self.__snapshots:
             snapshot_path = self.cache_dir / ("snapshot_" + name)
             if snapshot_path.is_file():
-                with open(snapshot_path, "rt", encoding="utf8") as f:
-                    self.__snapshots[name]["old"] = Snapshot.load(f.read())
+                self.__snapshots[name]["old"] = Snapshot.load(read_text(snapshot_path))
+
+            git_state_path = self.cache_dir / ("git_" + name)
+            if git_state_path.is_file():
+                self.__snapshots[name]["old_git"] = read_json(git_state_path)
 
         # load previous page-template relationships
         relationships_path = self.cache_dir / "relationships"
         if relationships_path.is_file():
-            with open(relationships_path, "rt", encoding="utf8") as f:
-                self.__templates = Relationships.from_dict(json.load(f))
+            self.__templates = Relationships.from_dict(read_json(relationships_path))
+
+        # load the markdown cache keys of each document
+        markdown_path = self.cache_dir / "markdown"
+        if markdown_path.is_file():
+            self.__markdown_keys = read_json(markdown_path)
+            self.__markdown_keys_modified = False
+
+        # load the hashes of the pages written in the output directory
+        output_path = self.cache_dir / "output"
+        if output_path.is_file():
+            self.__output_hashes = read_json(output_path)
+            self.__output_hashes_modified = False
 
         # load document tree
         doctree_path = self.cache_dir / "doctree"
         if doctree_path.is_file():
-            with open(doctree_path, "rt", encoding="utf8") as f:
-                self.__doctree = DocumentTree.from_dict(json.load(f))
+            self.__doctree = DocumentTree.from_dict(read_json(doctree_path))
 
     def __dump_cache_data(self):
         if not self.cache_dir.exists():
             self.cache_dir.mkdir()
 
+        # the cache files are serialised first, then written concurrently
+        writes = []
+
+        if not self.__cache_version_matches:
+            writes.append(
+                (write_text, self.cache_dir / "version", _CACHE_VERSION, True)
+            )
+
         # dump snapshots
-        for name in self.__snapshots:
-            snapshot_path = self.cache_dir / ("snapshot_" + name)
-            with open(snapshot_path, "wt", encoding="utf8") as f:
-                f.write(self.__snapshots[name]["current"].dump())
+        for name, snapshot in self.__snapshots.items():
+            if snapshot["current"] != snapshot.get("old"):
+                writes.append(
+                    (
+                        write_text,
+                        self.cache_dir / ("snapshot_" + name),
+                        snapshot["current"].dump(),
+                        True,
+                    )
+                )
+
+            git_state = snapshot.get("git")
+            if git_state is None:
+                git_state_path = self.cache_dir / ("git_" + name)
+                if git_state_path.exists():
+                    os.remove(git_state_path)
+            elif git_state != snapshot.get("old_git"):
+                writes.append((write_json, self.cache_dir / ("git_" + name), git_state))
 
         # dump page-template relationships
-        with open(self.cache_dir / "relationships", "wt", encoding="utf8") as f:
-            json.dump(self.__templates.to_dict(), f)
+        if self.__templates.modified:
+            writes.append(
+                (
+                    write_json,
+                    self.cache_dir / "relationships",
+                    self.__templates.to_dict(),
+                )
+            )
+
+        # dump the state of the plugins the markdown cache was made with
+        plugins_hash = self.__plugins_hash.hexdigest()
+        if plugins_hash != self.__old_plugins_hash:
+            writes.append((write_text, self.cache_dir / "plugins", plugins_hash, True))
+
+        # dump the markdown cache keys and remove the unused cache entries
+        if self.__markdown_keys_modified:
+            writes.append(
+                (write_json, self.cache_dir / "markdown", self.__markdown_keys)
+            )
+        for key in self.__markdown_orphans - set(self.__markdown_keys.values()):
+            try:
+                os.remove(os.path.join(self.__markdown_cache_root, key + ".json"))
+            except FileNotFoundError:
+                pass
+
+        # dump the hashes of the pages
+        if self.__output_hashes_modified:
+            writes.append((write_json, self.cache_dir / "output", self.__output_hashes))
 
         # dump document tree
-        with open(self.cache_dir / "doctree", "wt", encoding="utf8") as f:
-            json.dump(self.__doctree.to_dict(), f)
+        if self.__doctree.modified:
+            writes.append(
+                (write_json, self.cache_dir / "doctree", self.__doctree.to_dict())
+            )
+
+        if writes:
+            with ThreadPoolExecutor(len(writes)) as pool:
+                for future in [pool.submit(*write) for write in writes]:
+                    future.result()
 
     def __scan_directories(self):
-        for name in self.__snapshots:
-            self.__snapshots[name]["current"] = Snapshot.scan(
-                self.__snapshots[name]["path"]
-            )
+        # scanning is mostly waiting for the filesystem, so the directories are
+        # scanned concurrently
+        with ThreadPoolExecutor(len(self.__snapshots)) as pool:
+            scans = {
+                name: pool.submit(
+                    Snapshot.scan_git,
+                    snapshot["path"],
+                    snapshot.get("old"),
+                    snapshot.get("old_git"),
+                )
+                for name, snapshot in self.__snapshots.items()
+            }
+
+        for name, scan in scans.items():
+            (
+                self.__snapshots[name]["current"],
+                self.__snapshots[name]["git"],
+            ) = scan.result()
 
     def __render_pages(self):
-        created = list()
-        modified = list()
-        removed = list()
-        same = list()
-
-        for file, diff in self.snapshot_diff("source").items():
-            if diff == Diff.CREATED:
-                created.append(file)
-            elif diff == Diff.DELETED:
-                removed.append(file)
-            elif diff == Diff.MODIFIED:
-                modified.append(file)
-            elif diff == Diff.SAME:
-                same.append(file)
+        changes = self.snapshot_partition("source")
+        created = changes[Diff.CREATED]
+        modified = changes[Diff.MODIFIED]
+        removed = changes[Diff.DELETED]
+        same = changes[Diff.SAME]
 
         if same:
-            need_refresh = list()
-            for file, diff in self.snapshot_diff("templates").items():
-                if diff == Diff.MODIFIED:
-                    need_refresh += self.__templates.get_documents(file)
-            for file in same:
-                if file in need_refresh:
-                    modified.append(file)
+            need_refresh = set()
+            for file in self.snapshot_partition("templates")[Diff.MODIFIED]:
+                need_refresh.update(self.__templates.get_documents(file))
+            modified += [file for file in same if file in need_refresh]
 
         env_info = ", ".join(
             ([f"{len(created)} added"] if created else [])
@@ -257,54 +499,138 @@ class Builder:
             log.info("Document environment: no changes")
             return
 
-        for file in created:
-            self.__render_page(file, Diff.CREATED)
+        tasks = [(file, Diff.CREATED) for file in created] + [
+            (file, Diff.MODIFIED) for file in modified
+        ]
+
+        # the locations of the pages are computed and their directories created
+        # upfront, so that the render workers inherit them
+        self.__ensure_parent_directories(
+            self.__output_root,
+            (self.__page_location(file).destination for file, _ in tasks),
+        )
+
+        for (
+            file,
+            diff,
+            dst,
+            title,
+            templates,
+            postprocess,
+            markdown_key,
+            output_hash,
+        ) in self.__render_all(tasks):
+            file_status(dst, diff)
+
+            if diff == Diff.MODIFIED:
+                self.__doctree.edit_document(dst, title)
+            else:
+                self.__doctree.add_document(dst, title)
+
+            self.__templates.update(file, *templates)
+
+            if postprocess:
+                self.__postprocess.append(dst)
+
+            old_key = self.__markdown_keys.get(file)
+            if old_key != markdown_key:
+                if old_key is not None:
+                    self.__markdown_orphans.add(old_key)
+                self.__markdown_keys[file] = markdown_key
+                self.__markdown_keys_modified = True
 
-        for file in modified:
-            self.__render_page(file, Diff.MODIFIED)
+            if self.__output_hashes.get(file) != output_hash:
+                self.__output_hashes[file] = output_hash
+                self.__output_hashes_modified = True
+
+            file_status_done()
 
         for file in removed:
             self.__remove_page(file)
 
-    def __page_location(self, file):
-        base, _ = os.path.splitext(file)
-        dest = base + ".html"
+    def __render_all(self, tasks):
+        global _render_worker
 
-        return (
-            self.source_dir / file,
-            self.output_dir / dest,
-            dest,
-        )
+        jobs = self.__options.get("jobs")
+        if jobs is None:
+            jobs = (os.cpu_count() or 1) if _can_fork() else 1
+        jobs = min(jobs, len(tasks))
+
+        if jobs > 1 and self.__md.has_extension_instances:
+            # the state they collect would stay in the workers
+            log.info(
+                "Rendering in a single process: a plugin added extension instances"
+            )
+            jobs = 1
+
+        if jobs > 1 and _can_fork():
+            # the workers are forked so that they inherit the plugins and the
+            # markdown extensions, which can't be sent to a spawned process
+            self.__prewarm_templates(file for file, _ in tasks)
+            _render_worker = self.__render_page
+            try:
+                with ProcessPoolExecutor(
+                    jobs, mp_context=multiprocessing.get_context("fork")
+                ) as pool:
+                    yield from pool.map(
+                        _render_page_worker,
+                        tasks,
+                        chunksize=max(1, len(tasks) // (jobs * 4)),
+                    )
+            finally:
+                _render_worker = None
 
-    def __render_page(self, file, modified):
-        src_path, dst_path, dst = self.__page_location(file)
+        else:
+            for task in tasks:
+                yield self.__render_page(*task)
 
-        file_status(dst, modified)
+    def __prewarm_templates(self, files):
+        # the templates loaded before forking are inherited by all the workers,
+        # instead of being loaded by each of them
+        templates = set()
+        for file in files:
+            templates.update(self.__templates.get_templates(file))
 
-        depth = len(Path(file).parts) - 1
-        rel_root = "/".join([".."] * depth) if depth else "."
+        for template in templates:
+            try:
+                self.__j2.get_template(template)
+            except Exception:
+                pass  # the error will be reported by the page that uses it
 
-        with open(src_path, "rt", encoding="utf8") as f:
-            md = f.read()
+    def __page_location(self, file):
+        location = self.__page_locations.get(file)
+
+        if location is None:
+            destination = os.path.splitext(file)[0] + ".html"
+            location = _PageLocation(
+                os.path.join(self.__source_root, file),
+                os.path.join(self.__output_root, destination),
+                destination,
+                # snapshots paths are strings using the native separator
+                _relative_root(file.count(os.sep)),
+            )
+            self.__page_locations[file] = location
 
-        content = self.__md.render(md)
+        return location
 
-        template_path = str(
-            self.__find_template_file(file).relative_to(self.templates_dir)
-        )
+    def __render_page(self, file, diff):
+        # this may run in a worker process: the document tree, the
+        # relationships and the postprocessing list are updated by the caller
+        # from the returned values
+        location = self.__page_location(file)
+        dst_path = location.output
+        dst = location.destination
 
-        title = self.__md.document_title
-        if "title" in self.__md.metadata:
-            title = " — ".join(self.__md.metadata["title"])
+        md = read_text(location.source)
 
-        if modified == Diff.MODIFIED:
-            self.__doctree.edit_document(Path(dst), title)
-        else:
-            self.__doctree.add_document(Path(dst), title)
+        markdown_key, content, title, template = self.__render_markdown(md)
+
+        template_path = self.__find_template_file(file, template)
 
         rendering_context = {
-            "root": rel_root,
+            "root": location.root,
             "path": dst,
+            "postprocess": False,
         }
 
         shared = {
@@ -315,99 +641,161 @@ class Builder:
         }
 
         tpl = self.__j2.get_template(template_path)
-        content_tpl = self.__j2.from_string(content)
-
         self.__j2.dependencies.watch()
 
-        html = tpl.render(content=content_tpl.render(**shared), **shared)
+        # the same dictionary is used for both renders, Jinja copies it into
+        # the context of each of them anyway
+        shared["content"] = self.__render_content(content, shared)
+        html = tpl.render(shared)
 
-        self.__templates.update(
+        used_templates = [t.name for t in self.__j2.dependencies.used_last_watch()]
+
+        data = html.encode("utf8")
+        output_hash = hashlib.blake2b(data, digest_size=16).hexdigest()
+
+        # the page isn't written again if it didn't change, unless it still has
+        # to be postprocessed
+        if (
+            rendering_context["postprocess"]
+            or output_hash != self.__output_hashes.get(file)
+            or _file_size(dst_path) != len(data)
+        ):
+            self.__ensure_directory(os.path.dirname(dst_path))
+            write_file(dst_path, data)
+
+        return (
             file,
-            template_path,
-            self.__j2.dependencies.used_last_watch(),
+            diff,
+            dst,
+            title,
+            (template_path, used_templates),
+            rendering_context["postprocess"],
+            markdown_key,
+            output_hash,
         )
 
-        os.makedirs(dst_path.parent, exist_ok=True)
+    def __render_content(self, content, shared):
+        if not _JINJA_SYNTAX_RE.search(content):
+            # nothing for Jinja to do, except removing the trailing newline
+            return content[:-1] if content.endswith("\n") else content
+
+        return self.__j2.from_string(content).render(shared)
+
+    def __render_markdown(self, md):
+        # the HTML is cached so that pages rendered again because one of their
+        # templates changed don't go through markdown again
+        key = hashlib.blake2b(
+            (self.__md.signature + "\0" + md).encode("utf8"), digest_size=16
+        ).hexdigest()
+        cache_path = os.path.join(self.__markdown_cache_root, key + ".json")
+
+        # the extension instances added by the plugins must see every document
+        use_cache = not self.__md.has_extension_instances
+
+        if use_cache:
+            try:
+                cached = read_json(cache_path)
+                return key, cached["html"], cached["title"], cached["template"]
+            except (OSError, ValueError, KeyError):
+                pass
 
-        with open(dst_path, "wt+", encoding="utf8") as f:
-            f.write(html)
+        document = self.__md.render(md)
 
-        file_status_done()
+        content = document.html
+        title = document.title
+        if "title" in document.metadata:
+            title = " — ".join(document.metadata["title"])
+
+        template = document.template
+
+        if use_cache:
+            try:
+                write_json(
+                    cache_path, {"html": content, "title": title, "template": template}
+                )
+            except OSError as e:
+                log.warn(f"Failed to cache the markdown output: {e}")
+
+        return key, content, title, template
 
     def __remove_page(self, file):
-        _, path, dst = self.__page_location(file)
+        location = self.__page_location(file)
+        path, dst = location.output, location.destination
 
         file_status(dst, Diff.DELETED)
 
-        for template, sources in self.__templates.items():
-            if str(file) in sources:
-                self.__templates[template].remove(str(file))
+        self.__templates.remove(file)
+
+        self.__doctree.remove_document(dst)
 
-        self.__doctree.remove_document(Path(dst))
+        markdown_key = self.__markdown_keys.pop(file, None)
+        if markdown_key is not None:
+            self.__markdown_orphans.add(markdown_key)
+            self.__markdown_keys_modified = True
+
+        if self.__output_hashes.pop(file, None) is not None:
+            self.__output_hashes_modified = True
 
         try:
-            os.remove(self.output_dir / path)
-            click.echo("done")
+            os.remove(path)
+            file_status_done()
         except FileNotFoundError:
             print()
             log.warn(f"Failed to remove {path}: file is already gone")
 
-        file_status_done()
-
     def __postprocess_pages(self):
+        self.__docpath_cache = {}
+
         for doc in self.__postprocess:
             try:
-                with open(self.output_dir / doc, "rt", encoding="utf8") as f:
-                    content = f.read()
+                rewrite_file(
+                    os.path.join(self.__output_root, doc),
+                    partial(self.__postprocess_content, doc),
+                )
 
-                position = 0
-                new_content = str()
-                failed = []
-                while (start := content.find("<!--KOMOE:", position)) != -1:
-                    func_end = content.find("-->", start)
-                    end = func_end + 3  # include the -->
-                    func_start = start + 10  # ignore the <!--KOMOE:
+            except Exception as e:
+                log.warn(f"Failed to postprocess file {doc}:\n   {e}")
 
-                    new_content += content[position:start]
+    def __postprocess_content(self, doc, content):
+        parts = []
+        position = 0
+        failed = []
+        for marker in _MARKER_RE.finditer(content):
+            parts.append(content[position : marker.start()])
 
-                    try:
-                        op = json.loads(content[func_start:func_end])
-                        result = self.__postprocessors.get(op.pop("op"))(
-                            path=Path(doc), **op
-                        )
-                        new_content += result
-
-                    except Exception as e:
-                        failed.append(e)
+            try:
+                docpath = _DOCPATH_MARKER_RE.fullmatch(marker.group(1))
+                if docpath is not None:
+                    # the most common marker doesn't need to be parsed
+                    sep, maxdepth, include = docpath.groups()
+                    result = self.__document_path_postprocess(
+                        doc, sep.decode("utf8"), int(maxdepth), include == b"true"
+                    )
+                else:
+                    op = loads_json(marker.group(1))
+                    result = self.__postprocessors.get(op.pop("op"))(path=doc, **op)
+                parts.append(result.encode("utf8"))
 
-                    position = end
+            except Exception as e:
+                failed.append(e)
 
-                if failed:
-                    log.warn(
-                        f"Failed to postprocess one or more markers in file {doc}:\n   "
-                        + ", ".join(str(e) for e in failed)
-                    )
+            position = marker.end()
 
-                new_content += content[position:]
+        if failed:
+            log.warn(
+                f"Failed to postprocess one or more markers in file {doc}:\n   "
+                + ", ".join(str(e) for e in failed)
+            )
 
-                with open(self.output_dir / doc, "wt", encoding="utf8") as f:
-                    f.write(new_content)
+        parts.append(content[position:])
 
-            except Exception as e:
-                log.warn(f"Failed to postprocess file {doc}:\n   {e}")
+        return b"".join(parts)
 
     def __copy_static_files(self):
-        created = list()
-        modified = list()
-        removed = list()
-
-        for file, diff in self.snapshot_diff("static").items():
-            if diff == Diff.CREATED:
-                created.append(file)
-            elif diff == Diff.DELETED:
-                removed.append(file)
-            elif diff == Diff.MODIFIED:
-                modified.append(file)
+        changes = self.snapshot_partition("static")
+        created = changes[Diff.CREATED]
+        modified = changes[Diff.MODIFIED]
+        removed = changes[Diff.DELETED]
 
         env_info = ", ".join(
             ([f"{len(created)} added"] if created else [])
@@ -420,56 +808,96 @@ class Builder:
             log.info("Static environment: no changes")
             return
 
-        for file in created:
-            self.__copy_static_file(file, Diff.CREATED)
+        tasks = [(file, Diff.CREATED) for file in created] + [
+            (file, Diff.MODIFIED) for file in modified
+        ]
 
-        for file in modified:
-            self.__copy_static_file(file, Diff.MODIFIED)
+        self.__ensure_parent_directories(
+            self.__static_output_root, (file for file, _ in tasks)
+        )
+
+        # the copies are independent and mostly waiting on the disk, the status
+        # is printed by this thread once each of them is done
+        workers = min(32, (os.cpu_count() or 4) * 4)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for file, diff in executor.map(
+                lambda task: self.__copy_static_file(*task), tasks
+            ):
+                file_status(file, diff)
+                file_status_done()
 
         for file in removed:
             self.__remove_static_file(file)
 
-    def __copy_static_file(self, file, modified):
-        file_status(file, modified)
-
-        dest = self.static_output_dir / file
+    def __copy_static_file(self, file, diff):
+        # runs in a worker thread
+        dest = os.path.join(self.__static_output_root, file)
 
-        os.makedirs(dest.parent, exist_ok=True)
-        shutil.copy(self.static_dir / file, dest)
+        self.__ensure_directory(os.path.dirname(dest))
+        copy_file(os.path.join(self.__static_root, file), dest)
 
-        file_status_done()
+        return file, diff
 
     def __remove_static_file(self, file):
         file_status(file, Diff.DELETED)
 
         try:
-            os.remove(self.static_output_dir / file)
+            os.remove(os.path.join(self.__static_output_root, file))
             file_status_done()
         except FileNotFoundError:
             print()
             log.warn(f"Failed to remove {file}: file is already gone")
 
-    def __find_template_file(self, file):
-        directory, name = os.path.split(self.__md.template)
-        directory = self.templates_dir / directory
-
-        if not directory.is_dir():
-            log.error(f"No such template : {self.__md.template}")
-            raise click.ClickException(f"failed to render {file}")
-
+    def __index_templates(self):
+        # templates are referred to without their extensions, so every file is
+        # indexed by each of the names that could refer to it
+        self.__template_index = {}
+        for path in sorted(self.snapshot_current("templates")):
+            directory, name = os.path.split(path)
+            position = name.find(".")
+            while position != -1:
+                key = os.path.join(directory, name[:position])
+                self.__template_index.setdefault(key, path)
+                position = name.find(".", position + 1)
+
+    def __find_template_file(self, file, template):
         path = None
-        for f in directory.iterdir():
-            if f.is_file() and f.name.startswith(name + "."):
-                path = f
+        if template:
+            path = self.__template_index.get(os.path.normpath(template))
+
         if path is None:
-            log.error(f"No such template : {self.__md.template}")
+            log.error(f"No such template : {template}")
             raise click.ClickException(f"failed to render {file}")
 
         return path
 
+    def __ensure_parent_directories(self, root, files):
+        for directory in {os.path.dirname(file) for file in files}:
+            self.__ensure_directory(
+                os.path.join(root, directory) if directory else root
+            )
+
+    def __ensure_directory(self, path):
+        # most pages and static files share their directory with others
+        if path not in self.__created_dirs:
+            os.makedirs(path, exist_ok=True)
+
+            # the parents exist too now
+            while path not in self.__created_dirs:
+                self.__created_dirs.add(path)
+                parent = os.path.dirname(path)
+                if parent == path:
+                    break
+                path = parent
+
     def __clear_output_directory(self):
         if self.output_dir.is_dir():
             cleartree(self.output_dir)
+        self.__created_dirs.clear()
+
+    def __clear_markdown_cache(self):
+        if self.markdown_cache_dir.is_dir():
+            cleartree(self.markdown_cache_dir)
 
     def __root_path(self, ctx, path):
         if not path.startswith("/"):
@@ -484,28 +912,38 @@ class Builder:
         return repr(ctx.get("root") + "/_static" + path)
 
     def __document_path_marker(self, ctx, sep=" / ", maxdepth=0, include=True):
-        self.__postprocess.append(ctx.get("path"))
+        ctx["postprocess"] = True
 
         func = {"op": "docpath", "sep": sep, "maxdepth": maxdepth, "include": include}
 
-        return f"<!--KOMOE:{json.dumps(func)}-->"
+        return f"<!--KOMOE:{dumps_json(func).decode('utf8')}-->"
 
     def __document_path_postprocess(self, path, sep, maxdepth, include):
-        if path.stem == "index":
-            if len(path.parent.parts) == 0:  # root document
+        # the same marker is often found more than once in a page
+        key = (path, sep, maxdepth, include)
+        result = self.__docpath_cache.get(key)
+        if result is None:
+            result = self.__document_path(path, sep, maxdepth, include)
+            self.__docpath_cache[key] = result
+        return result
+
+    def __document_path(self, path, sep, maxdepth, include):
+        directory, name = os.path.split(path)
+        stem = os.path.splitext(name)[0]
+        directories = [part for part in directory.split(os.sep) if part]
+
+        if stem == "index":
+            if len(directories) == 0:  # root document
                 return ""
             else:
-                *parts, leaf = path.parent.parts
+                *parts, leaf = directories
                 offset = 1
         else:
-            parts = path.parent.parts
-            leaf = path.stem
+            parts = directories
+            leaf = stem
             offset = 0
 
-        rel = [
-            "/".join([".."] * d) if d else "."
-            for d in range(len(parts) + offset, offset - 1, -1)
-        ]
+        rel = [_relative_root(d) for d in range(len(parts) + offset, offset - 1, -1)]
 
         parent = self.__doctree.root
         nodes = [(f' href="{rel.pop(0)}"' if parent.is_document else "", parent.title)]
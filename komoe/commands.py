@@ -1,15 +1,13 @@
 import click
 import os
 from pathlib import Path
-import traceback
 
-import watchfiles
-
-from . import template, __version__
-from .config import ProjectConfig
-from .builder import Builder
+from . import __version__
 from . import log
 
+# the other modules are imported by the commands that need them, so that
+# `komoe --help` doesn't load markdown, jinja and watchfiles
+
 
 @click.group()
 def main():
@@ -43,6 +41,8 @@ def new(path, project_name):
     else:
         os.makedirs(path)
 
+    from . import template
+
     template.create_new_project(path, project_name)
 
 
@@ -61,7 +61,14 @@ def new(path, project_name):
 )
 @click.option("--fresh", is_flag=True, help="Regenerates all content")
 @click.option("--watch", is_flag=True, help="Rebuild as files change")
-def build(project_file, project_dir, fresh, watch):
+@click.option(
+    "--jobs",
+    "-j",
+    type=click.IntRange(min=1),
+    help="The number of processes rendering pages (defaults to the number of CPUs "
+    "on Linux, and to 1 on other platforms and when rebuilding with --watch)",
+)
+def build(project_file, project_dir, fresh, watch, jobs):
     """Build a project
 
     If no project is specified, the project in the current directory will be built.
@@ -70,55 +77,65 @@ def build(project_file, project_dir, fresh, watch):
     if project_file is not None:
         config_path = project_file
 
-    elif (project_dir is not None) and (
-        "komoe.toml" in f.name for f in project_dir.iterdir()
-    ):
+    else:
+        if project_dir is None:
+            project_dir = Path.cwd()
         config_path = project_dir / "komoe.toml"
+        if not config_path.is_file():
+            raise click.ClickException("project file not found")
 
-    elif "komoe.toml" in (f.name for f in Path.cwd().iterdir()):
-        config_path = Path.cwd() / "komoe.toml"
-
-    else:
-        raise click.ClickException("project file not found")
+    from .builder import Builder
 
     config = load_config(config_path)
 
-    builder = Builder(config, config_path.parent, fresh=fresh)
+    builder = Builder(config, config_path.parent, fresh=fresh, jobs=jobs)
     builder.build()
 
     if watch:
+        import traceback
+        import watchfiles
+
         while True:
             try:
                 click.echo("Waiting for a file to change ...")
-                for changes in watchfiles.watch(config_path.parent):
+                build_dirs, source_dirs = _watched_dirs(builder)
+                # the changes are reported with absolute paths, like the
+                # directory prefixes
+                for changes in watchfiles.watch(os.path.abspath(config_path.parent)):
                     need_rebuild = False
                     force_fresh = False
                     for _, file in changes:
-                        path = Path(file)
+                        # with a trailing separator, a directory is a prefix
+                        # of itself too
+                        path = file + os.sep
 
-                        if (not path.is_relative_to(builder.output_dir)) and (
-                            not path.is_relative_to(builder.cache_dir)
-                        ):
+                        if not path.startswith(build_dirs):
                             # source files
-                            if any(
-                                path.is_relative_to(srcdir)
-                                for srcdir in builder.snapshot_dirs
-                            ):
+                            if path.startswith(source_dirs):
                                 need_rebuild = True
 
                             # project file and plugins
-                            elif path.name == "komoe.toml" or path.suffix == ".py":
+                            elif file.endswith((os.sep + "komoe.toml", ".py")):
                                 need_rebuild = True
                                 force_fresh = True
+                                # the other changes can't change anything now
+                                break
 
                     if need_rebuild:
                         if force_fresh:
                             log.info("The project file or a plugin changed")
+                            config = load_config(config_path)
 
                         builder = Builder(
-                            config, config_path.parent, fresh=fresh or force_fresh
+                            config,
+                            config_path.parent,
+                            fresh=fresh or force_fresh,
+                            # the watcher's thread is running, forking is only
+                            # done when asked for
+                            jobs=jobs or 1,
                         )
                         builder.build()
+                        build_dirs, source_dirs = _watched_dirs(builder)
 
                         click.echo("Waiting for a file to change ...")
 
@@ -136,7 +153,23 @@ def build(project_file, project_dir, fresh, watch):
         click.echo("✨ All done ! ✨")
 
 
+def _dir_prefixes(dirs):
+    # absolute paths with a trailing separator, so that a directory isn't a
+    # prefix of its siblings with longer names
+    return tuple(os.path.join(os.path.abspath(d), "") for d in dirs)
+
+
+def _watched_dirs(builder):
+    # the directories written by the build, and the ones it reads from
+    return (
+        _dir_prefixes((builder.output_dir, builder.cache_dir)),
+        _dir_prefixes(builder.snapshot_dirs),
+    )
+
+
 def load_config(path):
+    from .config import ProjectConfig
+
     config = ProjectConfig.from_file(path)
 
     if config.minimum_required_version > __version__:
@@ -1,3 +1,6 @@
+import os
+from functools import lru_cache
+
 import click
 import tomli
 
@@ -5,12 +8,13 @@ from . import log
 from .version import Version
 
 
-def _require(cfg, *path):
+def _require(cfg, *path, parent=()):
+    # `parent` is the path of `cfg` itself, for the error message
     for key in path:
         if key in cfg:
             cfg = cfg[key]
         else:
-            log.error(f"{'.'.join(path)} is missing from configuration file")
+            log.error(f"{'.'.join(parent + path)} is missing from configuration file")
             raise click.ClickException("invalid configuration file")
     return cfg
 
@@ -28,16 +32,25 @@ class ProjectConfig:
     def __init__(self, cfg):
         self.__minimum_required_version = Version.parse(_require(cfg, "komoe_require"))
 
-        self.__source_dir = _require(cfg, "build", "source")
-        self.__templates_dir = _require(cfg, "build", "templates")
-        self.__static_dir = _require(cfg, "build", "static")
-        self.__output_dir = _require(cfg, "build", "output")
+        build = _require(cfg, "build")
+        self.__source_dir = _require(build, "source", parent=("build",))
+        self.__templates_dir = _require(build, "templates", parent=("build",))
+        self.__static_dir = _require(build, "static", parent=("build",))
+        self.__output_dir = _require(build, "output", parent=("build",))
 
         self.__project_infos = _default(cfg, {}, "project")
         self.__plugins = _default(cfg, {}, "plugin")
 
     @classmethod
     def from_file(cls, path):
+        # in watch mode, the project file is loaded again whenever a plugin
+        # changes, but it is only parsed again if it changed too
+        st = os.stat(path)
+        return cls.__load(os.fspath(path), st.st_mtime_ns, st.st_size)
+
+    @classmethod
+    @lru_cache(maxsize=8)
+    def __load(cls, path, mtime_ns, size):
         try:
             with open(path, "rb") as f:
                 toml_dict = tomli.load(f)
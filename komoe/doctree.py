@@ -1,6 +1,17 @@
+import os
+from pathlib import PurePath
+
 from . import log
 
 
+def _split(path):
+    # the parent directories and the stem of a document path, from either a
+    # string with native separators or a path object
+    directory, name = os.path.split(str(path) if isinstance(path, PurePath) else path)
+    parents = tuple(part for part in directory.split(os.sep) if part)
+    return parents, os.path.splitext(name)[0]
+
+
 class Node:
     def __init__(self, title, is_document):
         self.__title = title
@@ -35,21 +46,31 @@ class Node:
         self.__is_document = False
 
     def _to_dict(self):
-        return {
-            "title": self.__title,
-            "is_document": self.__is_document,
-            "children": {
-                docid: child._to_dict() for docid, child in self.__children.items()
-            },
-        }
+        # iterative, so that deep trees don't reach the recursion limit
+        d = {}
+        stack = [(self, d)]
+        while stack:
+            node, node_dict = stack.pop()
+            children = {}
+            node_dict["title"] = node.__title
+            node_dict["is_document"] = node.__is_document
+            node_dict["children"] = children
+            for docid, child in node.__children.items():
+                children[docid] = {}
+                stack.append((child, children[docid]))
+        return d
 
     @classmethod
     def _from_dict(cls, d, default_title="Home"):
-        node = cls(d["title"], d["is_document"])
-        node.__children = {
-            docid: Node._from_dict(child) for docid, child in d["children"].items()
-        }
-        return node
+        root = cls(d["title"], d["is_document"])
+        stack = [(root, d)]
+        while stack:
+            node, node_dict = stack.pop()
+            for docid, child_dict in node_dict["children"].items():
+                child = cls(child_dict["title"], child_dict["is_document"])
+                node.__children[docid] = child
+                stack.append((child, child_dict))
+        return root
 
     def get_child(self, docid):
         return self.__children.get(docid)
@@ -58,11 +79,17 @@ class Node:
 class DocumentTree:
     def __init__(self):
         self.__root = Node("Home", False)
+        self.__modified = True
 
     @property
     def root(self):
         return self.__root
 
+    @property
+    def modified(self):
+        """Whether the tree changed since it was created or loaded."""
+        return self.__modified
+
     def to_dict(self):
         return self.root._to_dict()
 
@@ -72,6 +99,7 @@ class DocumentTree:
 
         try:
             doctree.__root = Node._from_dict(d)
+            doctree.__modified = False
             return doctree
         except Exception as e:
             log.warn(f"Failed to load the document tree: {e}")
@@ -79,18 +107,18 @@ class DocumentTree:
         return doctree
 
     def add_document(self, path, title):
-        if path.stem == "index":
-            if len(path.parent.parts) == 0:  # root document
+        self.__modified = True
+
+        parent, stem = _split(path)
+        if stem == "index":
+            if len(parent) == 0:  # root document
                 if self.root.is_document:
                     log.warn(f"File {path} overwritten")
                 else:
                     self.root._found(title)
                 return
             else:
-                *parent, stem = path.parent.parts
-        else:
-            parent = path.parent.parts
-            stem = path.stem
+                *parent, stem = parent
 
         parent_node = self.__ensure_path_exists(self.root, parent)
 
@@ -107,14 +135,17 @@ class DocumentTree:
                 already_exists._found(title)
 
     def edit_document(self, path, title):
-        if path.stem == "index":
-            if len(path.parent.parts) == 0:  # root document
+        self.__modified = True
+
+        parent, stem = _split(path)
+        if stem == "index":
+            if len(parent) == 0:  # root document
                 self.root._found(title)
                 return
             else:
-                parts = path.parent.parts
+                parts = parent
         else:
-            parts = path.parent.parts + (path.stem,)
+            parts = parent + (stem,)
 
         node = self.__get_node(self.root, parts)
 
@@ -125,22 +156,22 @@ class DocumentTree:
             node._found(title)
 
     def remove_document(self, path):
-        if path.stem == "index":
-            if len(path.parent.parts) == 0:  # root document
+        self.__modified = True
+
+        parent, stem = _split(path)
+        if stem == "index":
+            if len(parent) == 0:  # root document
                 self.root._lost("Home")
                 return
             else:
-                *parent, stem = path.parent.parts
-        else:
-            parent = path.parent.parts
-            stem = path.stem
+                *parent, stem = parent
 
         parent_node = self.__get_node(self.root, parent)
 
         if parent_node is None:
             return
 
-        target_node = self.parent_node.get_child(stem)
+        target_node = parent_node.get_child(stem)
 
         if target_node is None:
             return
@@ -151,24 +182,19 @@ class DocumentTree:
             target_node._lost(stem.title())
 
     def __get_node(self, base, path):
-        if len(path) == 0:
-            return base
-
-        child = base.get_child(path[0])
-
-        if child is None:
-            return None
-
-        return self.__get_node(child, path[1:])
+        node = base
+        for part in path:
+            node = node.get_child(part)
+            if node is None:
+                return None
+        return node
 
     def __ensure_path_exists(self, base, path):
-        if len(path) == 0:
-            return base
-
-        child = base.get_child(path[0])
-
-        if child is None:
-            child = Node(path[0].title(), False)
-            base._add_child(path[0], child)
-
-        return self.__ensure_path_exists(child, path[1:])
+        node = base
+        for part in path:
+            child = node.get_child(part)
+            if child is None:
+                child = Node(part.title(), False)
+                node._add_child(part, child)
+            node = child
+        return node
@@ -0,0 +1,88 @@
+"""Interface to the Jinja library."""
+
+import jinja2
+from jinja2td import Target
+
+from . import __version__
+from .utils import read_json, write_json
+
+
+class IntrospectionBytecodeCache(jinja2.FileSystemBytecodeCache):
+    """A bytecode cache that works with `jinja2td`.
+
+    The dependencies of a template are registered by `jinja2td` when it is
+    compiled. They are saved alongside the bytecode and registered again when the
+    template is loaded from the cache, so that they are still tracked.
+    """
+
+    def __init__(self, directory):
+        super().__init__(
+            directory, f"komoe-{__version__}-jinja-{jinja2.__version__}-%s.cache"
+        )
+        self.__compiling = {}
+
+    def get_bucket(self, environment, name, filename, source):
+        bucket = super().get_bucket(environment, name, filename, source)
+
+        if bucket.code is not None and not self.__load_dependencies(
+            bucket, name, filename
+        ):
+            bucket.reset()  # compile the template again
+
+        if bucket.code is None:
+            self.__compiling[bucket.key] = name
+
+        return bucket
+
+    def set_bucket(self, bucket):
+        super().set_bucket(bucket)
+
+        name = self.__compiling.pop(bucket.key, None)
+        template = bucket.environment.dependencies.get_template(name)
+        if template is not None:
+            self.__dump_dependencies(bucket, template)
+
+    def __dependencies_filename(self, bucket):
+        return self._get_cache_filename(bucket) + ".deps"
+
+    def __load_dependencies(self, bucket, name, filename):
+        try:
+            data = read_json(self.__dependencies_filename(bucket))
+        except (OSError, ValueError):
+            return False
+
+        if data.get("checksum") != bucket.checksum:
+            return False
+
+        graph = bucket.environment.dependencies
+        graph._add_template(name, filename)
+        for dep in data["dependencies"]:
+            graph._register_dependency(
+                name,
+                dep.pop("type"),
+                [Target(dynamic, target) for dynamic, target in dep.pop("targets")],
+                **dep,
+            )
+
+        return True
+
+    def __dump_dependencies(self, bucket, template):
+        data = {
+            "checksum": bucket.checksum,
+            "dependencies": [
+                {
+                    "type": dep.type,
+                    "targets": [(t.is_dynamic, t.name) for t in dep.targets],
+                    "with_context": dep.with_context,
+                    "ignore_missing": dep.ignore_missing,
+                    "imported_as": dep.imported_as,
+                    "imported_names": dep.imported_names,
+                }
+                for dep in template.dependencies
+            ],
+        }
+
+        try:
+            write_json(self.__dependencies_filename(bucket), data)
+        except OSError:
+            pass  # the template will be compiled again next time
@@ -1,25 +1,40 @@
 import click
 
+# the messages passed to dbg are built even when this is false, so the calls
+# that format them are guarded with `if log.DEBUG:`
 DEBUG = False
 
+_COLORS = {"ERROR": "red", "WARNING": "yellow", "INFO": None, "DEBUG": "cyan"}
+
+# the prefixes are styled once, click removes the styles when the output isn't
+# a terminal
+_PREFIXES = {
+    level: click.style(f"[{level}] ", fg=color, bold=True)
+    for level, color in _COLORS.items()
+}
+
 
 def error(message):
-    __log("ERROR", "red", message)
+    __log("ERROR", message)
 
 
 def warn(message):
-    __log("WARNING", "yellow", message)
+    __log("WARNING", message)
 
 
 def info(message):
-    __log("INFO", None, message)
+    __log("INFO", message)
 
 
 def dbg(message):
     if DEBUG:
-        __log("DEBUG", "cyan", message)
+        __log("DEBUG", message)
+
 
+def __log(level, message):
+    color = _COLORS[level]
+    if color is not None:
+        message = click.style(message, fg=color)
 
-def __log(level, color, message):
-    click.secho(f"[{level}] ", nl=False, err=True, fg=color, bold=True)
-    click.secho(message, err=True, fg=color)
+    # a single write for the whole line
+    click.echo(_PREFIXES[level] + message, err=True)
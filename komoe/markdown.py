@@ -1,11 +1,40 @@
 """Interface to the markdown library."""
 
 import markdown
+import importlib
+import importlib.metadata
+import sys
 from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from functools import lru_cache
 
 from . import log
 
 
+@dataclass(frozen=True)
+class RenderedDocument:
+    """The output of `Markdown.render`."""
+
+    html: str
+    title: str
+    metadata: dict
+    template: str
+
+
+# the extensions enabled unless a plugin disables them, in that order
+_DEFAULT_EXTENSIONS = (
+    "attr_list",
+    "fenced_code",
+    "footnotes",
+    "tables",
+    "admonition",
+    "meta",
+    "sane_lists",
+    "smarty",
+    "toc",
+)
+
+
 class Markdown:
     """Wrappper around `markdown.Markdown`."""
 
@@ -14,19 +43,11 @@ class Markdown:
 
         self.__template = None
         self.__title = ""
+        self.__signature = None
 
-        self.__default_extensions = [
-            "attr_list",
-            "fenced_code",
-            "footnotes",
-            "tables",
-            "admonition",
-            "meta",
-            "sane_lists",
-            "smarty",
-            "toc",
-        ]
+        self.__disabled_extensions = set()
         self.__additional_extensions = []
+        self.__extension_instances = False
         self.__extensions_config = {}
 
     def init(self):
@@ -34,34 +55,73 @@ class Markdown:
 
         extensions = (
             [_MarkdownExtension()]
-            + self.__default_extensions
+            + [
+                name
+                for name in _DEFAULT_EXTENSIONS
+                if name not in self.__disabled_extensions
+            ]
             + [
                 ext.instanciate(self.__extensions_config)
                 for ext in self.__additional_extensions
             ]
         )
 
-        self.__md = markdown.Markdown(
-            extensions=extensions,
-            extension_configs=self.__extensions_config,
+        self.__signature = repr(
+            (
+                _RENDERER_VERSION,
+                markdown.__version__,
+                _describe(extensions[1:]),
+                sorted(
+                    {_package_version(_extension_module(ext)) for ext in extensions[1:]}
+                ),
+                _describe(self.__extensions_config),
+            )
+        )
+
+        # the renderer is reused by the next builds in watch mode, unless the
+        # extensions have objects from the plugins, which are loaded again
+        reusable = all(isinstance(ext, str) for ext in extensions[1:]) and _plain(
+            self.__extensions_config
         )
+
+        md = _renderers.get(self.__signature) if reusable else None
+        if md is None:
+            md = markdown.Markdown(
+                extensions=extensions,
+                extension_configs=self.__extensions_config,
+            )
+            if reusable:
+                _renderers.clear()
+                _renderers[self.__signature] = md
+
+        self.__md = md
         self.__md.komoe = self
 
-    def render(self, text: str) -> str:
+    def render(self, text: str) -> RenderedDocument:
         """Convert Markdown to HTML.
 
         Parameters
           text: the markdown inputt.
 
         Returns
-          the HTML output.
+          the HTML output, along with the title, metadata and template of the
+          document.
         """
 
         if self.__md is None:
             raise RuntimeError("Markdown renderer not initialised yet")
 
         self.__md.reset()
-        return self.__md.convert(text)
+        self.__template = None
+        self.__title = ""
+        html = self.__md.convert(text)
+
+        return RenderedDocument(
+            html,
+            self.__title,
+            dict(getattr(self.__md, "Meta", {})),
+            self.__template,
+        )
 
     def disable_default_extension(self, name: str):
         """Disables a default extension.
@@ -73,9 +133,27 @@ class Markdown:
                 documentation at https://python-markdown.github.io/extensions/.
         """
 
-        self.__default_extensions.remove(name)
+        if name not in _DEFAULT_EXTENSIONS:
+            raise ValueError(f"{name} isn't a default extension")
+
+        self.__disabled_extensions.add(name)
 
     def add_extension(self, extension, config_name=None, **config):
+        """Enables an extension.
+
+        Parameters
+          extension: the name of the extension, a class derived from
+                     `markdown.Extension`, or an instance of such a class.
+          config_name: the name of the configuration of a class extension.
+          config: the configuration of the extension.
+
+        Pages may be rendered in parallel by forked processes, and their markdown
+        output is cached between builds. An extension given as an instance can
+        keep state across documents, for the plugin to use it after the build:
+        when one is added, all the pages are converted in the main process and
+        none of them is taken from the cache.
+        """
+
         if isinstance(extension, str):
             if config_name is not None:
                 log.warn(
@@ -86,7 +164,7 @@ class Markdown:
             )
             self.configure_extension(extension, **config)
 
-        elif issubclass(extension, markdown.Extension):
+        elif isinstance(extension, type) and issubclass(extension, markdown.Extension):
             self.__additional_extensions.append(
                 _ClassMarkdownPluginExtension(extension, config, config_name)
             )
@@ -103,6 +181,7 @@ class Markdown:
             self.__additional_extensions.append(
                 _BasicMarkdownPluginExtension(extension)
             )
+            self.__extension_instances = True
 
         else:
             raise TypeError(
@@ -136,11 +215,104 @@ class Markdown:
     def metadata(self):
         return self.__md.Meta
 
+    @property
+    def has_extension_instances(self):
+        """Whether plugins added extensions as instances, that must see every
+        document in this process."""
+        return self.__extension_instances
+
+    @property
+    def signature(self):
+        """A string describing the extensions and their configuration, that
+        changes when the output of the renderer may change."""
+        return self.__signature
+
+
+# changed along with the signature when the output of komoe's own extension
+# changes, so that the cached pages are rendered again
+_RENDERER_VERSION = 2
+
+# the last renderer that can be reused, by signature
+_renderers = {}
+
+
+def _plain(value):
+    # whether the value only has data that `_describe` represents entirely
+    if isinstance(value, dict):
+        return all(_plain(item) for item in value.values())
+    elif isinstance(value, (list, tuple)):
+        return all(_plain(item) for item in value)
+    else:
+        return value is None or isinstance(value, (str, int, float))
+
+
+@lru_cache(maxsize=None)
+def _extension_name_module(name):
+    # the module markdown loads an extension from, when given its name
+    module = name.partition(":")[0]
+    if "." not in module:
+        for entry_point in markdown.util.get_installed_extensions():
+            if entry_point.name == module:
+                return entry_point.value.partition(":")[0]
+    return module
+
+
+def _extension_module(extension):
+    if isinstance(extension, str):
+        return _extension_name_module(extension)
+    return type(extension).__module__
+
+
+@lru_cache(maxsize=None)
+def _package_version(module):
+    # the version of the package a module is from, so that the cached pages
+    # are rendered again when it is upgraded
+    package = module.partition(".")[0]
+    if package == "markdown":
+        return package, markdown.__version__
+
+    try:
+        version = getattr(importlib.import_module(package), "__version__", None)
+    except ImportError:
+        version = None
+
+    if not isinstance(version, str):
+        version = None
+        for distribution in _distributions().get(package, [package]):
+            try:
+                version = importlib.metadata.version(distribution)
+                break
+            except importlib.metadata.PackageNotFoundError:
+                pass
+
+    return package, version
+
+
+@lru_cache(maxsize=None)
+def _distributions():
+    # the distributions of each top-level package, which can have another name
+    if sys.version_info >= (3, 10):
+        return importlib.metadata.packages_distributions()
+    return {}
+
+
+def _describe(value):
+    # like repr, but without memory addresses so that it is the same every build
+    if isinstance(value, dict):
+        return {key: _describe(item) for key, item in value.items()}
+    elif isinstance(value, (list, tuple)):
+        return [_describe(item) for item in value]
+    elif isinstance(value, markdown.Extension):
+        return (_describe(type(value)), _describe(value.getConfigs()))
+    elif callable(value) and hasattr(value, "__qualname__"):
+        return f"{getattr(value, '__module__', None)}.{value.__qualname__}"
+    else:
+        return repr(value)
+
 
 class _PluginMarkdownExtension(ABC):
     @abstractmethod
-    def instanciate(self, config):
-        ...
+    def instanciate(self, config): ...
 
 
 class _BasicMarkdownPluginExtension(_PluginMarkdownExtension):
@@ -180,23 +352,19 @@ class _MarkdownExtension(markdown.Extension):
             _TitleTreeprocessor(self.__md), "komoe.treeprocessor.title", 200
         )
 
-    def reset(self):
-        self.__md.template = None
-        self.__md.document_title = ""
-
 
 class _TemplatePreprocessor(markdown.preprocessors.Preprocessor):
     def run(self, lines):
-        new_lines = lines.copy()
-
-        while not new_lines[0].strip():
-            new_lines.pop(0)
+        # skip the leading blank lines without copying or shifting the others
+        i = 0
+        while i < len(lines) and not lines[i].strip():
+            i += 1
 
-        if new_lines[0].startswith("@"):
-            self.md.komoe.template = new_lines[0][1:]
-            new_lines.pop(0)
+        if i < len(lines) and lines[i].startswith("@"):
+            self.md.komoe.template = lines[i][1:]
+            i += 1
 
-        return new_lines
+        return lines[i:]
 
     def reset(self):
         self.md.komoe.template = None
@@ -204,5 +372,12 @@ class _TemplatePreprocessor(markdown.preprocessors.Preprocessor):
 
 class _TitleTreeprocessor(markdown.treeprocessors.Treeprocessor):
     def run(self, root):
-        h1 = root.find("h1")
-        self.md.komoe.document_title = h1.text if h1 is not None else ""
+        # the first top-level heading, like root.find("h1") without going
+        # through ElementPath
+        title = ""
+        for child in root:
+            if child.tag == "h1":
+                # an element without text has None instead
+                title = child.text or ""
+                break
+        self.md.komoe.document_title = title
@@ -19,26 +19,19 @@ __all__ = [
 ]
 
 
-class _ModuleEvents:
-    def __init__(self):
-        self.__on_start = list()
-        self.__on_end = list()
-
-    def register(self, event, action):
-        if event == "start":
-            self.__on_start.append(action)
-        elif event == "end":
-            self.__on_end.append(action)
-        else:
-            raise ValueError(f"invalid event “{event}”")
+# appended to the name of the plugins loaded from scripts to get their module
+_SCRIPT_SUFFIX = "_komoe_plugin"
+
+
+def _script_plugin_name(module):
+    # str.removesuffix needs Python 3.9
+    if module.endswith(_SCRIPT_SUFFIX):
+        return module[: -len(_SCRIPT_SUFFIX)]
+    return module
 
-    def on(self, event):
-        if event == "start":
-            return iter(self.__on_start)
-        elif event == "end":
-            return iter(self.__on_end)
-        else:
-            raise ValueError(f"invalid event “{event}”")
+
+# the events of a module that other plugins can subscribe to
+_EVENTS = ("start", "end")
 
 
 class _Action:
@@ -57,6 +50,7 @@ class _Action:
             )
         else:
             self.__called = True
+            self.__module.mark_done()
             return self.__callback(context, config)
 
     def reload(self):
@@ -75,22 +69,27 @@ class _ModuleActions:
     def __init__(self, name):
         self.__actions = list()
         self.__name = name
+        self.__done = 0  # the number of actions already called
 
     def reload(self):
         for action in self.__actions:
             action.reload()
+        self.__done = 0
 
     def add(self, action):
         action.module = self
         self.__actions.append(action)
 
+    def mark_done(self):
+        self.__done += 1
+
     @property
     def started(self):
-        return any(self.__actions)
+        return self.__done > 0
 
     @property
     def ended(self):
-        return all(self.__actions)
+        return self.__done == len(self.__actions)
 
     @property
     def name(self):
@@ -100,7 +99,7 @@ class _ModuleActions:
 class PluginScheduler:
     __setup = []
     __cleanup = []
-    __events = {}
+    __handlers = {}  # the actions to call, by (module, event)
     __actions = {}
 
     __context = None
@@ -108,21 +107,21 @@ class PluginScheduler:
 
     __scripts = []
 
+    # the proxies given to the plugins, by module, for the current context
+    __proxies = {}
+    # the plugin names of the modules registering callbacks, for the current context
+    __plugin_names = {}
+
     @classmethod
     def add_script(cls, module_name):
         if module_name in cls.__scripts:
-            log.dbg("script {module_name} is already loaded")
+            if log.DEBUG:
+                log.dbg(f"script {module_name} is already loaded")
             return False
         else:
             cls.__scripts.append(module_name)
             return True
 
-    @classmethod
-    def events(cls, module):
-        if module not in cls.__events:
-            cls.__events[module] = _ModuleEvents()
-        return cls.__events[module]
-
     @classmethod
     def actions(cls, module):
         if module not in cls.__actions:
@@ -130,12 +129,18 @@ class PluginScheduler:
 
         return cls.__actions[module]
 
+    @classmethod
+    def __plugin_name(cls, callback):
+        module = callback.__module__
+        name = cls.__plugin_names.get(module)
+        if name is None:
+            name = cls.__context.get_package_alias(module, _script_plugin_name(module))
+            cls.__plugin_names[module] = name
+        return name
+
     @classmethod
     def subscribe(cls, module, event, callback):
-        plugin_name = cls.__context.get_package_alias(
-            callback.__module__,
-            callback.__module__.replace("_komoe_plugin", ""),
-        )
+        plugin_name = cls.__plugin_name(callback)
         action_name = callback.__name__
 
         if plugin_name == module:
@@ -144,31 +149,25 @@ class PluginScheduler:
             )
             raise click.ClickException("failed to load plugins")
 
+        if event not in _EVENTS:
+            raise ValueError(f"invalid event “{event}”")
+
         action = _Action(callback)
 
-        events = cls.events(module)
-        events.register(event, action)
+        cls.__handlers.setdefault((module, event), []).append(action)
 
         actions = cls.actions(plugin_name)
         actions.add(action)
 
-        cls.events(plugin_name)
-
     @classmethod
     def register_setup(cls, callback):
-        plugin_name = cls.__context.get_package_alias(
-            callback.__module__,
-            callback.__module__.replace("_komoe_plugin", ""),
-        )
+        plugin_name = cls.__plugin_name(callback)
 
         cls.__setup.append((plugin_name, callback))
 
     @classmethod
     def register_cleanup(cls, callback):
-        plugin_name = cls.__context.get_package_alias(
-            callback.__module__,
-            callback.__module__.replace("_komoe_plugin", ""),
-        )
+        plugin_name = cls.__plugin_name(callback)
 
         cls.__cleanup.append((plugin_name, callback))
 
@@ -183,6 +182,8 @@ class PluginScheduler:
     @classmethod
     def set_context(cls, context):
         cls.__context = context
+        cls.__proxies.clear()
+        cls.__plugin_names.clear()
 
     @classmethod
     def set_config(cls, config):
@@ -190,23 +191,31 @@ class PluginScheduler:
 
     @classmethod
     def notify(cls, module, event):
-        for action in cls.__events[module].on(event):
+        for action in cls.__handlers.get((module, event), ()):
             if not action.module.started:
                 cls.notify(action.module.name, "start")
 
             action(
-                BuilderProxy(cls.__context, action.module.name),
+                cls.__proxy(action.module.name),
                 cls.__config.get(action.module.name, {}),
             )
 
             if action.module.ended:
                 cls.notify(action.module.name, "end")
 
+    @classmethod
+    def __proxy(cls, module):
+        builder_proxy = cls.__proxies.get(module)
+        if builder_proxy is None:
+            builder_proxy = BuilderProxy(cls.__context, module)
+            cls.__proxies[module] = builder_proxy
+        return builder_proxy
+
     @classmethod
     def setup(cls):
         for module, callback in cls.__setup:
             callback(
-                BuilderProxy(cls.__context, module),
+                cls.__proxy(module),
                 cls.__config.get(module, {}),
             )
 
@@ -214,7 +223,7 @@ class PluginScheduler:
     def cleanup(cls):
         for module, callback in cls.__cleanup:
             callback(
-                BuilderProxy(cls.__context, module),
+                cls.__proxy(module),
                 cls.__config.get(module, {}),
             )
 
@@ -227,14 +236,14 @@ class PluginScheduler:
     def reset(cls):
         cls.__setup.clear()
         cls.__cleanup.clear()
-        cls.__events.clear()
+        cls.__handlers.clear()
         cls.__actions.clear()
         cls.__scripts.clear()
 
         cls.__context = None
         cls.__config = None
-
-        cls.__events["build!"] = _ModuleEvents()
+        cls.__proxies.clear()
+        cls.__plugin_names.clear()
 
 
 class LogProxy:
@@ -307,6 +316,9 @@ class BuilderProxy:
     def snapshot_diff(self, name):
         return self.__builder.snapshot_diff(name)
 
+    def snapshot_partition(self, name):
+        return self.__builder.snapshot_partition(name)
+
     @property
     def markdown(self):
         return self.__md
@@ -1,30 +1,61 @@
 class Relationships:
     def __init__(self):
         self.__rel = {}
+        self.__by_source = {}
+        self.__modified = True
 
     @classmethod
     def from_dict(cls, data):
         rel = cls()
-        rel.__rel = data
+        rel.__rel = {template: set(dependents) for template, dependents in data.items()}
+        for template, dependents in rel.__rel.items():
+            for source in dependents:
+                rel.__by_source.setdefault(source, set()).add(template)
+        rel.__modified = False
         return rel
 
+    @property
+    def modified(self):
+        """Whether the relationships changed since they were created or loaded."""
+        return self.__modified
+
     def to_dict(self):
-        return self.__rel
+        # sorted so that the cache file is stable
+        return {
+            template: sorted(dependents) for template, dependents in self.__rel.items()
+        }
 
     def update(self, source, base_template, other_templates):
-        all_templates = [base_template] + [t.name for t in other_templates]
+        # only the templates that were or are now used by the source are visited
+        old_templates = self.__by_source.get(source, set())
+        new_templates = {base_template, *other_templates}
+
+        if new_templates == old_templates:
+            return
+
+        for template in old_templates - new_templates:
+            self.__rel[template].discard(source)
+
+        for template in new_templates - old_templates:
+            self.__rel.setdefault(template, set()).add(source)
 
-        for old_template, dependents in self.__rel.items():
-            if old_template in all_templates:
-                all_templates.remove(old_template)
-                if source not in dependents:
-                    dependents.append(source)
-            else:
-                if source in dependents:
-                    dependents.remove(source)
+        self.__by_source[source] = new_templates
+        self.__modified = True
 
-        for new_template in all_templates:
-            self.__rel[new_template] = [source]
+    def remove(self, source):
+        """Removes a source from the dependents of all its templates."""
+
+        templates = self.__by_source.pop(source, None)
+        if templates is None:
+            return
+
+        for template in templates:
+            self.__rel[template].discard(source)
+
+        self.__modified = True
 
     def get_documents(self, template):
-        return self.__rel.get(template, [])
+        return self.__rel.get(template, set())
+
+    def get_templates(self, source):
+        return self.__by_source.get(source, set())
@@ -1,4 +1,12 @@
-from pathlib import Path
+import os
+import re
+import stat
+import sys
+import time
+import hashlib
+import subprocess
+from functools import lru_cache
+from pathlib import Path, PurePath
 from enum import Enum, auto
 
 
@@ -9,73 +17,468 @@ class Diff(Enum):
     DELETED = auto()
 
 
-def _scan(root, path, ignore_hidden, ignore_patterns):
-    files = {}
+def _translate_part(part):
+    # like fnmatch.translate, but the wildcards don't match slashes
+    i, n = 0, len(part)
+    regex = []
+    while i < n:
+        c = part[i]
+        i += 1
+        if c == "*":
+            regex.append("[^/]*")
+        elif c == "?":
+            regex.append("[^/]")
+        elif c == "[":
+            j = i
+            if j < n and part[j] == "!":
+                j += 1
+            if j < n and part[j] == "]":
+                j += 1
+            while j < n and part[j] != "]":
+                j += 1
+            if j >= n:
+                regex.append("\\[")
+            else:
+                chars = re.sub(r"([&~|\\[])", r"\\\1", part[i:j])
+                i = j + 1
+                if chars.startswith("!"):
+                    regex.append(f"[^{chars[1:]}/]")
+                elif chars.startswith("^"):
+                    regex.append(f"[\\{chars}]")
+                else:
+                    regex.append(f"[{chars}]")
+        else:
+            regex.append(re.escape(c))
+    return "".join(regex)
 
-    for e in path.iterdir():
-        if ignore_hidden and e.name.startswith("."):
-            continue
 
-        ignore = False
-        for pattern in ignore_patterns:
-            if e.match(pattern):
-                ignore = True
-        if ignore:
+@lru_cache(maxsize=16)
+def _compile_patterns(patterns):
+    # a single regex with the semantics of PurePath.match for all the patterns,
+    # matched against paths with forward slashes
+    if not patterns:
+        return None
+
+    alternatives = []
+    for pattern in patterns:
+        pure = PurePath(pattern)
+        if not pure.parts:
+            raise ValueError("empty pattern")
+
+        parts = [
+            _translate_part(part) for part in pure.parts[1 if pure.anchor else 0 :]
+        ]
+        if pure.anchor:
+            anchor = re.escape(pure.anchor.replace("\\", "/"))
+            alternatives.append("^" + anchor + "/".join(parts))
+        else:
+            alternatives.append("(?:^|/)" + "/".join(parts))
+
+    flags = re.IGNORECASE if os.name == "nt" else 0
+    return re.compile("(?:" + "|".join(alternatives) + ")$", flags)
+
+
+def _match_patterns(regex, path):
+    if os.sep != "/":
+        path = path.replace(os.sep, "/")
+    return regex.search(path) is not None
+
+
+def _listings(files, dirs):
+    # the files and subdirectories of each directory of a previous scan
+    listings = {directory: ([], []) for directory in dirs}
+    for rel in files:
+        directory, name = os.path.split(rel)
+        if directory in listings:
+            listings[directory][0].append(name)
+    for rel in dirs:
+        if rel:
+            directory, name = os.path.split(rel)
+            if directory in listings:
+                listings[directory][1].append(name)
+    return listings
+
+
+def _walk(root, ignore_hidden, ignored, dirs, previous_files, previous_dirs, recent):
+    # iterative walk with os.scandir, which gets the type of the entries from
+    # the directory listing instead of calling stat on each of them
+    listings = _listings(previous_files, previous_dirs)
+
+    root = str(root)
+    stack = [(root, "", os.stat(root))]
+
+    while stack:
+        directory, rel, st = stack.pop()
+        prefix = rel + os.sep if rel else ""
+
+        # a directory modified too close to the scan could change again
+        # without its mtime changing, so it is recorded without one and it will
+        # be listed again next time (it still has to be recorded to stay in
+        # the listing of its parent)
+        mtime = st.st_mtime_ns
+        dirs[rel] = mtime if mtime < recent else None
+
+        if rel in listings and previous_dirs[rel] == mtime:
+            # the entries of the directory are the same as in the previous
+            # scan, but the files themselves could have changed
+            files, subdirs = listings[rel]
+            for name in files:
+                path = os.path.join(directory, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                if stat.S_ISREG(st.st_mode):
+                    yield prefix + name, path, st
+
+            for name in subdirs:
+                path = os.path.join(directory, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                if stat.S_ISDIR(st.st_mode):
+                    stack.append((path, prefix + name, st))
+
             continue
 
-        if e.is_file():
-            files[str(e.relative_to(root))] = int(e.stat().st_mtime)
+        with os.scandir(directory) as entries:
+            for e in entries:
+                if ignore_hidden and e.name.startswith("."):
+                    continue
+
+                if ignored is not None and _match_patterns(ignored, e.path):
+                    continue
+
+                if e.is_file():
+                    yield prefix + e.name, e.path, e.stat()
+
+                elif e.is_dir():
+                    stack.append((e.path, prefix + e.name, e.stat()))
+
+
+# first line of the snapshot files, changed when the format changes
+_HEADER = "# komoe snapshot 3"
+
+# timestamps can be as coarse as 2 seconds, depending on the filesystem
+_RACY_MTIME_NS = 2_000_000_000
+
+
+def _blake2b():
+    return hashlib.blake2b(digest_size=16)
+
+
+def _hash_file(path):
+    with open(path, "rb") as f:
+        if sys.version_info >= (3, 11):
+            h = hashlib.file_digest(f, _blake2b)
+        else:
+            h = _blake2b()
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                h.update(chunk)
+    return h.hexdigest()
+
+
+def _recent():
+    # the modification times after this one aren't trusted
+    return time.time_ns() - _RACY_MTIME_NS
+
+
+def _entry(path, st, old, recent):
+    # the content is only hashed again if the size or the mtime changed
+    if old is not None and old[0] == st.st_size and old[1] == st.st_mtime_ns:
+        return old
+
+    # like the directories, a file modified too close to the scan could change
+    # again with the same size and mtime, so it will be hashed again next time
+    mtime = st.st_mtime_ns
+    return (st.st_size, mtime if mtime < recent else None, _hash_file(path))
+
+
+def _scan(root, ignore_hidden, ignore_patterns, previous_files, previous_dirs):
+    dirs = {}
+    recent = _recent()
+    files = {
+        rel: _entry(path, st, previous_files.get(rel), recent)
+        for rel, path, st in _walk(
+            root,
+            ignore_hidden,
+            _compile_patterns(tuple(ignore_patterns)),
+            dirs,
+            previous_files,
+            previous_dirs,
+            recent,
+        )
+    }
+    return files, dirs
+
+
+def _options(root, ignore_hidden, ignore_patterns):
+    # the listings of a previous scan can only be reused with the same options
+    h = _blake2b()
+    h.update(
+        repr((os.path.abspath(root), ignore_hidden, tuple(ignore_patterns))).encode(
+            "utf8"
+        )
+    )
+    return h.hexdigest()
+
+
+def _ignored(root, path, ignore_hidden, ignored):
+    if ignore_hidden and any(part.startswith(".") for part in path.parts):
+        return True
+
+    if ignored is None:
+        return False
+
+    # matched like the entries of the walk, which are joined to the root and
+    # don't go into the ignored directories
+    full_path = root
+    for part in path.parts:
+        full_path = os.path.join(full_path, part)
+        if _match_patterns(ignored, full_path):
+            return True
+
+    return False
+
 
-        elif e.is_dir():
-            files.update(_scan(root, e, ignore_hidden, ignore_patterns))
+def _git(root, *args):
+    return subprocess.run(
+        ["git", "-C", str(root), *args], capture_output=True, check=True
+    ).stdout.decode("utf8")
 
-    return files
+
+def _git_state(root):
+    # the files that git can't vouch for: modified, untracked and ignored ones
+    prefix = _git(root, "rev-parse", "--show-prefix").strip()
+    head = _git(root, "rev-parse", "HEAD").strip()
+
+    status = _git(
+        root,
+        "status",
+        "--porcelain",
+        "-z",
+        "--untracked-files=all",
+        "--ignored=traditional",
+        "--",
+        ".",
+    ).split("\0")
+
+    dirty = []
+    entries = iter(status)
+    for entry in entries:
+        if not entry:
+            continue
+
+        dirty.append(entry[3:])
+        if "R" in entry[:2] or "C" in entry[:2]:
+            dirty.append(next(entries))  # the origin of the rename/copy
+
+    return {
+        # the directory the state describes, so that it isn't used for another
+        "root": os.path.abspath(root),
+        "prefix": prefix,
+        "head": head,
+        "dirty": [
+            path[len(prefix) :].replace("/", os.sep)
+            for path in dirty
+            if path.startswith(prefix)
+        ],
+    }
 
 
 class Snapshot:
-    def __init__(self, files):
+    def __init__(self, files, dirs=None, options=""):
         self.__files = files
+        # the modification times of the directories, with the options of the
+        # scan they were listed by
+        self.__dirs = {} if dirs is None else dirs
+        self.__options = options
+
+    def __iter__(self):
+        return iter(self.__files)
+
+    def __eq__(self, other):
+        if not isinstance(other, Snapshot):
+            return NotImplemented
+        return (
+            self.__files == other.__files
+            and self.__dirs == other.__dirs
+            and self.__options == other.__options
+        )
 
     @classmethod
-    def scan(cls, root, ignore_hidden=True, ignore_patterns=[]):
+    def scan(cls, root, ignore_hidden=True, ignore_patterns=[], previous=None):
+        """Scans a directory.
+
+        The files that have the same size and modification time as in the
+        `previous` snapshot aren't read again, and the directories that have
+        the same modification time aren't listed again.
+        """
+
         if not isinstance(root, Path):
             root = Path(root)
 
         if not root.is_dir():
             raise ValueError("root must be an existing directory")
 
-        return cls(_scan(root, root, ignore_hidden, ignore_patterns))
+        options = _options(root, ignore_hidden, ignore_patterns)
+
+        if previous is None:
+            previous_files, previous_dirs = {}, {}
+        elif previous.__options != options:
+            previous_files, previous_dirs = previous.__files, {}
+        else:
+            previous_files, previous_dirs = previous.__files, previous.__dirs
+
+        files, dirs = _scan(
+            root, ignore_hidden, ignore_patterns, previous_files, previous_dirs
+        )
+        return cls(files, dirs, options)
+
+    @classmethod
+    def scan_git(cls, root, old, old_state, ignore_hidden=True, ignore_patterns=[]):
+        """Scans a directory in a git repository.
+
+        Only the files that changed in git since the previous scan are checked
+        again. The other files are taken from the old snapshot.
+
+        Returns
+          the new snapshot and the git state to pass to the next scan, or `None`
+          if the directory isn't in a git repository.
+        """
+
+        if not isinstance(root, Path):
+            root = Path(root)
+
+        try:
+            state = _git_state(root)
+        except (OSError, subprocess.CalledProcessError):
+            return cls.scan(root, ignore_hidden, ignore_patterns, old), None
+
+        # the old snapshot and state can only be updated if they describe the
+        # same directory, scanned with the same options
+        if (
+            old is None
+            or old_state is None
+            or old.__options != _options(root, ignore_hidden, ignore_patterns)
+            or old_state.get("root") != state["root"]
+            or old_state.get("prefix") != state["prefix"]
+        ):
+            return cls.scan(root, ignore_hidden, ignore_patterns, old), state
+
+        try:
+            changed = _git(
+                root,
+                "diff",
+                "--name-only",
+                "-z",
+                "--relative",
+                old_state["head"],
+                state["head"],
+                "--",
+                ".",
+            ).split("\0")
+        except (OSError, subprocess.CalledProcessError):
+            return cls.scan(root, ignore_hidden, ignore_patterns, old), state
+
+        candidates = set(state["dirty"]) | set(old_state["dirty"])
+        candidates.update(path.replace("/", os.sep) for path in changed if path)
+
+        ignored = _compile_patterns(tuple(ignore_patterns))
+        recent = _recent()
+        files = dict(old.__files)
+        for path in candidates:
+            if _ignored(str(root), PurePath(path), ignore_hidden, ignored):
+                continue
+
+            full_path = root / path
+            try:
+                st = os.stat(full_path)
+            except FileNotFoundError:
+                files.pop(path, None)
+                continue
+
+            if stat.S_ISREG(st.st_mode):
+                files[path] = _entry(full_path, st, old.__files.get(path), recent)
+            elif stat.S_ISDIR(st.st_mode):
+                # a submodule or an untracked directory
+                return cls.scan(root, ignore_hidden, ignore_patterns, old), state
+            else:
+                files.pop(path, None)
+
+        # git reported every file added to or removed from the directories,
+        # so their listings are as up to date as the files
+        return cls(files, old.__dirs, old.__options), state
 
     @classmethod
     def load(cls, text):
+        header, _, text = text.partition("\n")
+        if header != _HEADER:
+            # snapshot from another version, everything will be rescanned
+            return cls({})
+
+        options, _, text = text.partition("\n")
+
         data = {}
+        dirs = {}
         for entry in text.split("\n"):
             if len(entry) == 0:
                 continue
-            path, time = entry.rsplit(":", 1)
-            time = int(time)
-            data[path] = time
-        return cls(data)
+            if entry.startswith("/"):
+                # relative paths of files never start with a slash
+                path, mtime = entry[1:].rsplit(":", 1)
+                dirs[path] = int(mtime) if mtime else None
+            else:
+                path, size, mtime, digest = entry.rsplit(":", 3)
+                data[path] = (int(size), int(mtime) if mtime else None, digest)
+        return cls(data, dirs, options)
 
     def dump(self):
-        text = str()
-        for path, time in self.__files.items():
-            text += f"{path}:{time}\n"
-        return text
+        lines = [_HEADER, self.__options]
+        lines.extend(
+            f"{path}:{size}:{'' if mtime is None else mtime}:{digest}"
+            for path, (size, mtime, digest) in self.__files.items()
+        )
+        lines.extend(
+            f"/{path}:{'' if mtime is None else mtime}"
+            for path, mtime in self.__dirs.items()
+        )
+        lines.append("")
+        return "\n".join(lines)
 
     def diff(self, old):
-        diff_dict = {}
-
-        for entry in set(self.__files) | set(old.__files):
-            if entry in self.__files:
-                if entry in old.__files:
-                    if self.__files[entry] == old.__files[entry]:
-                        diff_dict[entry] = Diff.SAME
-                    else:
-                        diff_dict[entry] = Diff.MODIFIED
-                else:
-                    diff_dict[entry] = Diff.CREATED
+        current, previous = self.__files, old.__files
+
+        diff_dict = dict.fromkeys(current.keys() - previous.keys(), Diff.CREATED)
+        diff_dict.update(dict.fromkeys(previous.keys() - current.keys(), Diff.DELETED))
+        for entry in current.keys() & previous.keys():
+            # compare the content hashes
+            if current[entry][2] == previous[entry][2]:
+                diff_dict[entry] = Diff.SAME
             else:
-                diff_dict[entry] = Diff.DELETED
+                diff_dict[entry] = Diff.MODIFIED
 
         return diff_dict
+
+    def partition(self, old):
+        """Compares the snapshot to an older one, like `diff`.
+
+        Returns
+          a dictionary with the list of files for each kind of `Diff`.
+        """
+
+        groups = {kind: [] for kind in Diff}
+
+        for entry, info in self.__files.items():
+            old_info = old.__files.get(entry)
+            if old_info is None:
+                groups[Diff.CREATED].append(entry)
+            elif info[2] == old_info[2]:
+                groups[Diff.SAME].append(entry)
+            else:
+                groups[Diff.MODIFIED].append(entry)
+
+        groups[Diff.DELETED] = [e for e in old.__files if e not in self.__files]
+
+        return groups
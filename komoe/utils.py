@@ -1,6 +1,16 @@
-import os, shutil, pathlib
+import os, sys, shutil, pathlib, json
 import click
 
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+try:
+    import orjson  # optional, faster than the json module
+except ImportError:
+    orjson = None
+
 from .snapshot import Diff
 
 
@@ -22,6 +32,165 @@ def file_status_done():
     click.echo("\x1b[2D✓")
 
 
+def read_text(path):
+    with open(path, "rb") as f:
+        text = f.read().decode("utf8")
+
+    # binary mode doesn't translate line endings
+    if "\r" in text:
+        text = text.replace("\r\n", "\n").replace("\r", "\n")
+
+    return text
+
+
+def write_file(path, data, atomic=False):
+    """Writes a binary file. If `atomic` is true, the content is written to a
+    temporary file first, so that the file is never left half-written."""
+
+    if not atomic:
+        with open(path, "wb") as f:
+            f.write(data)
+        return
+
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def write_text(path, text, atomic=False):
+    """Same as `write_file`, but with text."""
+
+    write_file(path, text.encode("utf8"), atomic)
+
+
+def loads_json(data):
+    """Parses JSON from bytes or a string."""
+
+    return _json_loads(data)
+
+
+def dumps_json(data):
+    """Serialises data to compact JSON, as UTF-8 bytes."""
+
+    return _json_dumps(data)
+
+
+def read_json(path):
+    """Reads a JSON cache file."""
+
+    with open(path, "rb") as f:
+        # both parsers accept UTF-8 bytes directly, without decoding them first
+        return _json_loads(f.read())
+
+
+def write_json(path, data):
+    """Writes a JSON cache file atomically, in its most compact form."""
+
+    write_file(path, _json_dumps(data), True)
+
+
+def rewrite_file(path, transform):
+    """Replaces the content of a file with `transform(content)`, using the same
+    file descriptor for reading and writing. The content is passed as bytes."""
+
+    fd = os.open(path, os.O_RDWR | getattr(os, "O_BINARY", 0))
+    try:
+        size = os.fstat(fd).st_size
+        chunks = []
+        while chunk := os.read(fd, size or 1 << 16):
+            chunks.append(chunk)
+
+        original = b"".join(chunks)
+        data = transform(original)
+        if data == original:
+            return
+
+        os.lseek(fd, 0, os.SEEK_SET)
+        os.ftruncate(fd, 0)
+        view = memoryview(data)
+        while view:
+            view = view[os.write(fd, view) :]
+    finally:
+        os.close(fd)
+
+
+if orjson is not None:
+    _json_loads = orjson.loads
+    _json_dumps = orjson.dumps
+
+else:
+    _json_loads = json.loads
+
+    def _json_dumps(data):
+        return json.dumps(data, separators=(",", ":"), ensure_ascii=False).encode(
+            "utf8"
+        )
+
+
+# the ioctl that makes a copy-on-write clone of a file on Linux
+_FICLONE = getattr(fcntl, "FICLONE", 0x40049409) if sys.platform == "linux" else None
+
+
+def _clone_file(fsrc, fdst):
+    if _FICLONE is None:
+        return False
+
+    try:
+        fcntl.ioctl(fdst.fileno(), _FICLONE, fsrc.fileno())
+        return True
+    except OSError:  # the filesystem doesn't support it
+        return False
+
+
+def _copy_file_range(src_fd, dst_fd, count):
+    if not hasattr(os, "copy_file_range"):
+        raise OSError("os.copy_file_range is not available")
+    return os.copy_file_range(src_fd, dst_fd, count)
+
+
+def _sendfile(src_fd, dst_fd, count):
+    if sys.platform != "linux":  # other systems only send to sockets
+        raise OSError("os.sendfile can't copy files on this platform")
+    return os.sendfile(dst_fd, src_fd, None, count)
+
+
+def copy_file(src, dst):
+    """Copies the content and the permissions of a file. The file is cloned when
+    the filesystem supports it, otherwise the data is copied by the kernel with
+    `os.copy_file_range` or `os.sendfile` when possible."""
+
+    with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+        if not _clone_file(fsrc, fdst):
+            size = os.fstat(fsrc.fileno()).st_size
+            remaining = size
+
+            for kernel_copy in (_copy_file_range, _sendfile):
+                try:
+                    while remaining > 0:
+                        copied = kernel_copy(fsrc.fileno(), fdst.fileno(), remaining)
+                        if copied == 0:
+                            break
+                        remaining -= copied
+                except OSError:
+                    pass  # not supported by the platform or the filesystem
+
+                if remaining < size:
+                    break  # the next method would have nothing to copy
+
+            # the size can be wrong (files in /proc, files that grew, filesystems
+            # that don't support the kernel copies), so the rest is copied until
+            # the end of the file
+            shutil.copyfileobj(fsrc, fdst, 1 << 20)
+
+    shutil.copymode(src, dst)
+
+
 def cleartree(path):
     if not isinstance(path, pathlib.Path):
         path = pathlib.Path(path)
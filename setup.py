@@ -34,6 +34,9 @@ setup(
         "tomli>=2.0.1",
         "watchfiles>=0.18.1",
     ],
+    extras_require={
+        "fast": ["orjson>=3.8"],
+    },
     entry_points={
         "console_scripts": [
             "komoe = komoe.commands:main",
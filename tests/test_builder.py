@@ -0,0 +1,140 @@
+import hashlib
+import os
+import shutil
+
+import click
+import pytest
+
+from komoe.builder import Builder
+from komoe.config import ProjectConfig
+from komoe.utils import read_json
+
+_PROJECT = """komoe_require = '0.3'
+[project]
+name = 'Test'
+[build]
+source = 'source'
+templates = 'templates'
+static = 'static'
+output = 'build'
+"""
+
+
+def _write(path, text):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(text)
+
+
+@pytest.fixture
+def project(tmp_path):
+    _write(tmp_path / "komoe.toml", _PROJECT)
+    _write(
+        tmp_path / "templates" / "base.j2.html",
+        "<title>{{ title }}</title><nav>{{ document_path() }}</nav>{{ content }}",
+    )
+    _write(tmp_path / "static" / "style.css", "body {}")
+    _write(tmp_path / "source" / "index.md", "@base\n\n# Home\n\nWelcome")
+    for i in range(8):
+        _write(
+            tmp_path / "source" / "guide" / f"page{i}.md",
+            f"@base\n\n# Page {i}\n\nThe page number {{{{ {i} }}}}",
+        )
+    return tmp_path
+
+
+# well before the builds, so that a rewrite changes the mtime
+_OLD = 1_500_000_000
+
+
+def _build(root, fresh=False, jobs=1):
+    config = ProjectConfig.from_file(root / "komoe.toml")
+    Builder(config, root, fresh=fresh, jobs=jobs).build()
+
+
+def _output(root):
+    return {
+        str(path.relative_to(root / "build")): path.read_bytes()
+        for path in sorted((root / "build").rglob("*"))
+        if path.is_file()
+    }
+
+
+def test_cache_of_another_version_is_discarded(project, capsys):
+    _build(project)
+    expected = _output(project)
+
+    # a cache written by a version with another snapshot format
+    (project / ".cache" / "version").unlink(missing_ok=True)
+    (project / ".cache" / "snapshot_source").write_text("# komoe snapshot 2\n")
+    capsys.readouterr()
+    _build(project)
+
+    assert "overwritten" not in capsys.readouterr().err
+    assert _output(project) == expected
+
+
+def test_parallel_build_is_the_same_as_serial(project, tmp_path_factory):
+    copy = tmp_path_factory.mktemp("parallel") / "project"
+    shutil.copytree(project, copy)
+
+    _build(project, jobs=1)
+    _build(copy, jobs=4)
+    assert _output(copy) == _output(project)
+
+    # pages rendered again because their template changed
+    for root in (project, copy):
+        _write(
+            root / "templates" / "base.j2.html",
+            "<h1>{{ title }}</h1><nav>{{ document_path() }}</nav>{{ content }}",
+        )
+    _build(project, jobs=1)
+    _build(copy, jobs=4)
+    assert _output(copy) == _output(project)
+
+
+@pytest.mark.parametrize("jobs", [1, 4])
+def test_render_error_is_reported(project, jobs):
+    _write(project / "source" / "guide" / "broken.md", "@missing\n\n# Broken")
+
+    with pytest.raises(click.ClickException, match="failed to render"):
+        _build(project, jobs=jobs)
+
+
+def _without_postprocessing(root):
+    # the pages with markers are always written again to be postprocessed
+    _write(
+        root / "templates" / "base.j2.html", "<title>{{ title }}</title>{{ content }}"
+    )
+
+
+def test_identical_page_is_not_written_again(project):
+    _without_postprocessing(project)
+    _build(project)
+    page = project / "build" / "index.html"
+    os.utime(page, (_OLD, _OLD))
+
+    # the pages are rendered again, to the same HTML
+    _write(
+        project / "templates" / "base.j2.html",
+        "<title>{{ title }}</title>{# unchanged #}{{ content }}",
+    )
+    _build(project)
+
+    assert os.stat(page).st_mtime == _OLD
+
+
+def test_changed_page_is_written_again(project):
+    _without_postprocessing(project)
+    _build(project)
+    page = project / "build" / "index.html"
+    os.utime(page, (_OLD, _OLD))
+    old_hash = read_json(project / ".cache" / "output")["index.md"]
+
+    _write(project / "source" / "index.md", "@base\n\n# Home\n\nWelcome back")
+    _build(project)
+
+    new_hash = read_json(project / ".cache" / "output")["index.md"]
+    assert os.stat(page).st_mtime != _OLD
+    assert b"Welcome back" in page.read_bytes()
+    assert new_hash != old_hash
+    assert new_hash == hashlib.blake2b(page.read_bytes(), digest_size=16).hexdigest()
@@ -0,0 +1,55 @@
+import markdown
+from markdown.treeprocessors import Treeprocessor
+
+from komoe.markdown import Markdown
+
+
+class _Counter(markdown.Extension):
+    def __init__(self):
+        super().__init__()
+        self.documents = 0
+
+    def extendMarkdown(self, md):
+        counter = self
+
+        class _Count(Treeprocessor):
+            def run(self, root):
+                counter.documents += 1
+
+        md.treeprocessors.register(_Count(md), "count", 0)
+
+
+def test_extension_instance_sees_every_document():
+    counter = _Counter()
+    md = Markdown()
+    md.add_extension(counter)
+    md.init()
+
+    md.render("# One")
+    md.render("# Two")
+
+    assert md.has_extension_instances
+    assert counter.documents == 2
+
+
+def test_extension_names_and_classes_are_not_instances():
+    md = Markdown()
+    md.add_extension("abbr")
+    md.add_extension(_Counter)
+    md.init()
+
+    md.render("# One")
+
+    assert not md.has_extension_instances
+
+
+def test_signature_changes_with_the_markdown_version(monkeypatch):
+    md = Markdown()
+    md.init()
+    before = md.signature
+
+    monkeypatch.setattr(markdown, "__version__", "0.0.0")
+    md = Markdown()
+    md.init()
+
+    assert md.signature != before
@@ -0,0 +1,77 @@
+from komoe.relationships import Relationships
+
+_SOURCES = ["index.md", "about.md", "guide/intro.md"]
+
+
+def _assert_consistent(rel):
+    # the reverse index has exactly the pairs of the forward sets
+    forward = {
+        (template, source)
+        for template, sources in rel.to_dict().items()
+        for source in sources
+    }
+    reverse = {
+        (template, source)
+        for source in _SOURCES
+        for template in rel.get_templates(source)
+    }
+    assert forward == reverse
+
+
+def _relationships():
+    rel = Relationships()
+    rel.update("index.md", "base.html", ["nav.html"])
+    rel.update("about.md", "page.html", ["base.html"])
+    rel.update("guide/intro.md", "page.html", ["base.html", "nav.html"])
+    return rel
+
+
+def test_page_switching_templates():
+    rel = _relationships()
+
+    rel.update("about.md", "other.html", ["nav.html"])
+
+    assert rel.get_templates("about.md") == {"other.html", "nav.html"}
+    assert rel.get_documents("page.html") == {"guide/intro.md"}
+    assert rel.get_documents("base.html") == {"index.md", "guide/intro.md"}
+    assert rel.get_documents("nav.html") == {
+        "index.md",
+        "about.md",
+        "guide/intro.md",
+    }
+    _assert_consistent(rel)
+
+
+def test_removed_source():
+    rel = _relationships()
+
+    rel.remove("guide/intro.md")
+
+    assert rel.get_templates("guide/intro.md") == set()
+    assert rel.get_documents("page.html") == {"about.md"}
+    assert rel.get_documents("nav.html") == {"index.md"}
+    _assert_consistent(rel)
+
+    # removing it again changes nothing
+    rel.remove("guide/intro.md")
+    _assert_consistent(rel)
+
+
+def test_dict_round_trip():
+    rel = _relationships()
+    rel.update("about.md", "other.html", [])
+    rel.remove("index.md")
+
+    loaded = Relationships.from_dict(rel.to_dict())
+
+    assert not loaded.modified
+    assert loaded.to_dict() == rel.to_dict()
+    for source in _SOURCES:
+        assert loaded.get_templates(source) == rel.get_templates(source)
+    _assert_consistent(loaded)
+
+    # the loaded reverse index is used by the next updates
+    loaded.update("guide/intro.md", "other.html", [])
+    assert loaded.get_documents("page.html") == set()
+    assert loaded.get_documents("other.html") == {"about.md", "guide/intro.md"}
+    _assert_consistent(loaded)
@@ -0,0 +1,144 @@
+import os
+import shutil
+import subprocess
+
+import pytest
+
+from komoe.snapshot import Snapshot, Diff
+
+# well before the scans, so that the directories aren't recent
+_OLD = 1_500_000_000
+
+
+def _write(path, text):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(text)
+
+
+def _backdate(root):
+    for directory, dirnames, filenames in os.walk(root):
+        for name in dirnames + filenames:
+            os.utime(os.path.join(directory, name), (_OLD, _OLD))
+    os.utime(root, (_OLD, _OLD))
+
+
+def test_recent_directory_stays_in_parent_listing(tmp_path):
+    _write(tmp_path / "index.md", "home")
+    _write(tmp_path / "guide" / "a.md", "a")
+    _write(tmp_path / "guide" / "deep" / "b.md", "b")
+    _backdate(tmp_path)
+
+    first = Snapshot.scan(tmp_path)
+
+    # only the subdirectory changes, its parent keeps its old mtime
+    _write(tmp_path / "guide" / "new.md", "new")
+    second = Snapshot.scan(tmp_path, previous=first)
+
+    _write(tmp_path / "index.md", "edited")
+    os.utime(tmp_path, (_OLD, _OLD))
+    third = Snapshot.scan(tmp_path, previous=Snapshot.load(second.dump()))
+
+    expected = {
+        "index.md",
+        os.path.join("guide", "a.md"),
+        os.path.join("guide", "new.md"),
+        os.path.join("guide", "deep", "b.md"),
+    }
+    assert set(second) == expected
+    assert set(third) == expected
+    assert third.partition(second)[Diff.DELETED] == []
+
+
+def test_unchanged_directories_are_reused(tmp_path):
+    _write(tmp_path / "a" / "b.md", "b")
+    _write(tmp_path / "c.md", "c")
+    _backdate(tmp_path)
+
+    first = Snapshot.scan(tmp_path)
+
+    # editing a file doesn't change the mtime of its directory
+    _write(tmp_path / "a" / "b.md", "changed")
+    os.utime(tmp_path / "a", (_OLD, _OLD))
+    second = Snapshot.scan(tmp_path, previous=first)
+
+    assert second.diff(first) == {
+        os.path.join("a", "b.md"): Diff.MODIFIED,
+        "c.md": Diff.SAME,
+    }
+    assert Snapshot.load(second.dump()) == second
+
+
+def test_recent_file_is_hashed_again(tmp_path):
+    _write(tmp_path / "page.md", "first")
+    mtime = os.stat(tmp_path / "page.md").st_mtime_ns
+
+    first = Snapshot.load(Snapshot.scan(tmp_path).dump())
+
+    # edited again within the same timestamp, with the same size
+    _write(tmp_path / "page.md", "again")
+    os.utime(tmp_path / "page.md", ns=(mtime, mtime))
+    second = Snapshot.scan(tmp_path, previous=first)
+
+    assert second.diff(first) == {"page.md": Diff.MODIFIED}
+
+
+def _git(cwd, *args):
+    subprocess.run(["git", *args], cwd=cwd, check=True, capture_output=True)
+
+
+def _git_commit_all(cwd):
+    _git(cwd, "init", "-q")
+    _git(cwd, "add", ".")
+    _git(
+        cwd,
+        "-c",
+        "user.name=test",
+        "-c",
+        "user.email=test@example.com",
+        "commit",
+        "-q",
+        "-m",
+        "init",
+    )
+
+
+@pytest.mark.skipif(shutil.which("git") is None, reason="git is not installed")
+def test_git_scan_of_another_root_starts_over(tmp_path):
+    _write(tmp_path / "source" / "index.md", "home")
+    _write(tmp_path / "source" / "guide" / "a.md", "a")
+    _write(tmp_path / "src2" / "other.md", "other")
+    _git_commit_all(tmp_path)
+
+    old, state = Snapshot.scan_git(tmp_path / "source", None, None)
+    assert state is not None
+
+    new, _ = Snapshot.scan_git(tmp_path / "src2", old, state)
+
+    assert set(new) == {"other.md"}
+
+
+@pytest.mark.skipif(shutil.which("git") is None, reason="git is not installed")
+def test_git_scan_ignores_the_same_files(tmp_path):
+    root = tmp_path / "source"
+    _write(root / "index.md", "home")
+    _write(root / "sub" / "a.md", "a")
+    _write(root / "sub" / "keep.txt", "keep")
+    _git_commit_all(tmp_path)
+
+    patterns = ["source/sub/*.md"]
+    old, state = Snapshot.scan_git(root, None, None, ignore_patterns=patterns)
+
+    # the new files are only looked at through git
+    _write(root / "sub" / "zz.md", "zz")
+    _write(root / "sub" / "new.txt", "new")
+    _write(root / "other.md", "other")
+    new, _ = Snapshot.scan_git(root, old, state, ignore_patterns=patterns)
+
+    expected = {
+        "index.md",
+        "other.md",
+        os.path.join("sub", "keep.txt"),
+        os.path.join("sub", "new.txt"),
+    }
+    assert set(Snapshot.scan(root, ignore_patterns=patterns)) == expected
+    assert set(new) == expected
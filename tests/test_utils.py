@@ -0,0 +1,41 @@
+import os
+
+import pytest
+
+from komoe import utils
+
+
+def _no_clone(fsrc, fdst):
+    return False
+
+
+@pytest.fixture
+def source(tmp_path):
+    path = tmp_path / "source.bin"
+    path.write_bytes(os.urandom(3 << 20))
+    return path
+
+
+def test_copy_file(tmp_path, source):
+    utils.copy_file(source, tmp_path / "copy.bin")
+    assert (tmp_path / "copy.bin").read_bytes() == source.read_bytes()
+
+
+def test_copy_file_when_the_kernel_copies_nothing(tmp_path, source, monkeypatch):
+    # some filesystems return 0 from copy_file_range instead of failing
+    monkeypatch.setattr(utils, "_clone_file", _no_clone)
+    monkeypatch.setattr(utils, "_copy_file_range", lambda src, dst, count: 0)
+    monkeypatch.setattr(utils, "_sendfile", lambda src, dst, count: 0)
+
+    utils.copy_file(source, tmp_path / "copy.bin")
+    assert (tmp_path / "copy.bin").read_bytes() == source.read_bytes()
+
+
+def test_copy_file_longer_than_its_size(tmp_path, monkeypatch):
+    monkeypatch.setattr(utils, "_clone_file", _no_clone)
+    status = "/proc/self/status"
+    if not os.path.exists(status):
+        pytest.skip("no procfs")
+
+    utils.copy_file(status, tmp_path / "status")
+    assert (tmp_path / "status").read_bytes().startswith(b"Name:")